@@ -0,0 +1,305 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import os
+import argparse
+import json
+import gzip
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+import tracemalloc
+import multiprocessing
+import contextlib
+import io
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from time import perf_counter, process_time, time
+
+import wot
+try:
+    import resource                                 # Not available on Windows
+except ImportError:
+    resource = None
+
+
+# Constants
+NATIONS = ['china', 'czech', 'france', 'germany', 'italy', 'japan', 'poland', 'sweden', 'uk', 'usa', 'ussr', 'intunion']
+TYPES = ['heavyTank', 'AT-SPG', 'mediumTank', 'lightTank', 'SPG']
+
+
+# Synthetic data
+def _tankopedia(count, seed):
+    # Lines of 10 tiers spread over the nations and the types, with some premium tanks out of the tree
+    rnd = random.Random(seed)
+    tanks = {}
+    tank_id = 1
+    while len(tanks) < count:
+        nation = NATIONS[(tank_id // 50) % len(NATIONS)]
+        type = TYPES[(tank_id // 10) % len(TYPES)]
+        prev = None
+        for tier in range(1, wot.MAX_TIER + 1):
+            premium = rnd.random() < 0.1
+            tanks[tank_id] = {'tank_id': tank_id,
+                              'type': type,
+                              'nation': nation,
+                              'tier': tier,
+                              'tag': 'T%d' % tank_id,
+                              'name': '%s %s %d-%d' % (nation.title(), type, tier, tank_id),
+                              'is_premium': premium,
+                              'is_gift': False,
+                              'is_wheeled': False,
+                              'default_profile': {'hp': 100 * tier},
+                              'price_credit': 0 if premium else 2000 * tier * tier,
+                              'price_gold': 5000 if premium else 0,
+                              'prices_xp': None if premium or prev is None else {str(prev): 1000 * tier * tier},
+                              'modules_tree': {str(tank_id * 10 + i): {'is_default': i == 0, 'price_xp': 500 * tier, 'price_credit': 1000 * tier} for i in range(4)},
+                              'next_tanks': None}
+            if not premium:
+                if prev is not None:
+                    tanks[prev]['next_tanks'] = {str(tank_id): 1000 * tier * tier}
+                prev = tank_id
+            tank_id += 1
+            if len(tanks) >= count:
+                break
+    return tanks
+
+
+def _player_tanks(account_id, tank_ids, count, epoch):
+    rnd = random.Random(account_id)
+    result = []
+    for tank_id in rnd.sample(tank_ids, min(count, len(tank_ids))):
+        battles = rnd.randint(1, 2000) + epoch
+        result.append({'tank_id': tank_id,
+                       'statistics': {'battles': battles, 'wins': int(battles * rnd.uniform(0.4, 0.6))},
+                       'mark_of_mastery': rnd.randint(0, 4)})
+    return result
+
+
+# Fake API, in a separate process to not disturb the measures
+class _FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlparse(self.path)
+        query = {}
+        for k, v in parse_qs(url.query).items():
+            query[k] = v[0]
+        method = '/'.join([e for e in url.path.split('/') if e != ''][1:])
+        error = {'field': None, 'message': 'METHOD_NOT_FOUND', 'code': 404, 'value': None}
+        if self.server.random.random() < config['errors']:
+            # Part of the calls are rejected like the API does above the allowed rate
+            data = None
+            error = {'field': None, 'message': 'REQUEST_LIMIT_EXCEEDED', 'code': 407, 'value': None}
+        elif method == 'encyclopedia/info':
+            data = {'tanks_updated_at': config['seed'], 'game_version': '1.0'}
+        elif method == 'encyclopedia/vehicles':
+            data = {}
+            for tank in self.server.tanks.values():
+                if tank['tier'] == wot._int(query.get('tier', 0)) and tank['type'] == query.get('type'):
+                    data[str(tank['tank_id'])] = tank
+        elif method == 'account/list':
+            data = []
+            for name in query.get('search', '').split(','):
+                if name.startswith('Player'):
+                    data.append({'nickname': name, 'account_id': 500000000 + wot._int(name[6:])})
+        elif method == 'account/info':
+            data = {}
+            for account_id in query.get('account_id', '').split(','):
+                data[account_id] = {'account_id': wot._int(account_id),
+                                    'nickname': 'Player%d' % (wot._int(account_id) - 500000000),
+                                    'last_battle_time': 1600000000 + self.server.epoch.value,
+                                    'updated_at': 1600000000 + self.server.epoch.value}
+        elif method == 'account/tanks':
+            data = {}
+            for account_id in query.get('account_id', '').split(','):
+                data[account_id] = _player_tanks(wot._int(account_id), self.server.tank_ids, config['tanks_per_player'], self.server.epoch.value)
+        else:
+            data = None
+        body = json.dumps({'status': 'ok', 'data': data} if data is not None else {'status': 'error', 'error': error}).encode('utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, 1)
+        with self.server.counters.get_lock():
+            self.server.counters[0] += 1
+            self.server.counters[1] += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_fake_api(port, config, counters, epoch, ready):
+    server = ThreadingHTTPServer(('127.0.0.1', port), _FakeApiHandler)
+    server.config = config
+    server.tanks = _tankopedia(config['tanks'], config['seed'])
+    server.tank_ids = sorted(server.tanks)
+    server.random = random.Random(config['seed'])
+    server.counters = counters
+    server.epoch = epoch
+    ready.set()
+    server.serve_forever()
+
+
+# Measures
+class Bench():
+    def __init__(self, counters, memory=False):
+        self.counters = counters
+        self.memory = memory
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name, db=None, items=0):
+        calls, size = self.counters[0], self.counters[1]
+        rows = db.total_changes if db is not None else 0
+        if self.memory:
+            tracemalloc.start()
+        wall, cpu = perf_counter(), process_time()
+        entry = {'phase': name, 'items': items}
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield entry
+        entry['wall'] = perf_counter() - wall
+        entry['cpu'] = process_time() - cpu
+        if self.memory:
+            entry['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        entry['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else 0
+        entry['http_calls'] = self.counters[0] - calls
+        entry['http_bytes'] = self.counters[1] - size
+        entry['rows'] = (db.total_changes - rows) if db is not None else 0
+        entry['items_per_second'] = entry['items'] / entry['wall'] if entry['wall'] > 0 else 0
+        entry['rows_per_second'] = entry['rows'] / entry['wall'] if entry['wall'] > 0 else 0
+        self.phases.append(entry)
+        print('%-20s %9.3f s %9.3f s cpu %8d items %10.1f /s %8d rows %10.1f rows/s %6d calls %10d bytes%s' %
+              (name, entry['wall'], entry['cpu'], entry['items'], entry['items_per_second'],
+               entry['rows'], entry['rows_per_second'], entry['http_calls'], entry['http_bytes'],
+               ' %8.1f MB peak' % (entry['peak_memory'] / 1048576) if self.memory else ''))
+
+
+def run(argv):
+    # Fake API
+    counters = multiprocessing.Array('q', 2)
+    epoch = multiprocessing.Value('i', 0)
+    ready = multiprocessing.Event()
+    config = {'tanks': argv.tanks, 'tanks_per_player': argv.tanks_per_player, 'seed': argv.seed, 'errors': argv.errors}
+    server = multiprocessing.Process(target=_serve_fake_api, args=(argv.port, config, counters, epoch, ready), daemon=True)
+    server.start()
+    ready.wait()
+
+    # Fresh database
+    folder = tempfile.mkdtemp(prefix='wot-bench-')
+    try:
+        transport = wot.HttpTransport('http://127.0.0.1:%d/%%s/' % argv.port, rate=argv.rate)
+        tree = wot.WotTree(transport, os.path.join(folder, 'wot.db'))
+        tree.tld = 'eu'
+        tree.language = 'en'
+        bench = Bench(counters, memory=argv.memory)
+        names = ['Player%d' % i for i in range(argv.players)]
+
+        # Phases
+        with bench.phase('cache_tanks', tree.db, argv.tanks):
+            tree.cache_tanks(refresh=True)
+        with bench.phase('search_players', tree.db, argv.players):
+            accounts = tree.search_players(names)
+        with bench.phase('cache_players', tree.db, argv.players):
+            tree.cache_players(list(accounts.values()))
+        with bench.phase('refresh_idle', tree.db, argv.players):
+            tree.cache_players(list(accounts.values()), refresh=True)
+        with bench.phase('refresh_no_cache', tree.db, argv.players):
+            # Sequence of --no-cache, where the names are searched again before the refresh
+            accounts = tree.search_players(names, refresh=True)
+            tree.cache_players(list(accounts.values()), refresh=True)
+        epoch.value += 1
+        with bench.phase('refresh_active', tree.db, argv.players):
+            tree.cache_players(list(accounts.values()), refresh=True)
+        sample = names[:argv.render]
+        with bench.phase('generate_graphviz', tree.db, len(sample)):
+            for name in sample:
+                tree.player, tree.account_id = name, accounts[name]
+                tree.generate_graphviz(os.path.join(folder, name + '.png'))
+        with bench.phase('generate_svg', tree.db, len(sample)):
+            for name in sample:
+                tree.player, tree.account_id = name, accounts[name]
+                tree.generate_svg(os.path.join(folder, name + '.svg'))
+        if shutil.which('dot') is not None:
+            pictures = sample[:argv.pictures]
+            with bench.phase('generate_picture', tree.db, len(pictures)):
+                for name in pictures:
+                    tree.generate_picture(os.path.join(folder, name + '.png'))
+            with bench.phase('render_players', tree.db, len(pictures)):
+                tree.render_players(dict([(name, accounts[name]) for name in pictures]), os.path.join(folder, '{player}.png'))
+        tree.db.close()
+    finally:
+        server.terminate()
+        shutil.rmtree(folder, ignore_errors=True)
+    return bench.phases
+
+
+def main():
+    # Read the command line
+    parser = argparse.ArgumentParser(description='World of Tanks - Benchmark of wot.py against a synthetic API')
+    parser.add_argument('--tanks', type=int, default=2000, help='Number of tanks in the tankopedia')
+    parser.add_argument('--players', type=int, default=10000, help='Number of players in the roster')
+    parser.add_argument('--tanks-per-player', type=int, default=150, help='Number of tanks owned by each player')
+    parser.add_argument('--render', type=int, default=100, help='Number of players whose tree is generated')
+    parser.add_argument('--pictures', type=int, default=10, help='Number of pictures rendered with GraphViz, when available')
+    parser.add_argument('--rate', type=int, default=1000, help='Requests per second allowed to the fake API')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic data')
+    parser.add_argument('--errors', type=float, default=0, help='Share of the calls rejected with REQUEST_LIMIT_EXCEEDED by the fake API')
+    parser.add_argument('--port', type=int, default=18900, help='Port of the fake API')
+    parser.add_argument('--memory', action='store_true', help='Measure the peak of the Python allocations (slower)')
+    parser.add_argument('--output', default='', help='JSON file where the results are saved')
+    parser.add_argument('--compare', default='', help='JSON file of a previous run to compare with')
+    argv = parser.parse_args()
+
+    # Run
+    phases = run(argv)
+    result = {'timestamp': int(time()),
+              'python': platform.python_version(),
+              'sqlite': wot.sqlite3.sqlite_version,
+              'parameters': {'tanks': argv.tanks,
+                             'players': argv.players,
+                             'tanks_per_player': argv.tanks_per_player,
+                             'render': argv.render,
+                             'pictures': argv.pictures,
+                             'rate': argv.rate,
+                             'seed': argv.seed,
+                             'errors': argv.errors},
+              'phases': phases}
+    try:
+        result['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+
+    # Save
+    if argv.output != '':
+        with open(argv.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
+
+    # Compare
+    if argv.compare != '':
+        with open(argv.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous['parameters'] != result['parameters']:
+            print('Warning: the parameters of the runs differ')
+        before = dict([(p['phase'], p) for p in previous['phases']])
+        print('\nComparison with %s (%s)' % (argv.compare, previous.get('commit', '?')))
+        for p in phases:
+            if p['phase'] in before and before[p['phase']]['wall'] > 0:
+                print('%-20s %9.3f s -> %9.3f s (%+.1f%%)' % (p['phase'], before[p['phase']]['wall'], p['wall'],
+                                                             100.0 * (p['wall'] / before[p['phase']]['wall'] - 1)))
+    return True
+
+
+if __name__ == '__main__':
+    main()
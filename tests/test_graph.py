@@ -0,0 +1,77 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import unittest
+
+import wot
+
+
+# Constants
+# Nation "a": 1 -> 2 and 3, both parents of 4, then 4 -> 5, with a premium 6 and an orphan 7 out of the tree
+# Nation "b": 11 -> 12
+TANKS = [(1, 'a', 'lightTank', 1, 0, 0, '', 0),
+         (2, 'a', 'lightTank', 2, 100, 1000, '', 0),
+         (3, 'a', 'mediumTank', 2, 200, 500, '', 0),
+         (4, 'a', 'mediumTank', 3, 1000, 10000, '', 0),
+         (5, 'a', 'heavyTank', 4, 3000, 30000, '', 0),
+         (6, 'a', 'heavyTank', 8, 0, 0, 'X', 5000),
+         (7, 'a', 'mediumTank', 5, 0, 0, '', 0),
+         (11, 'b', 'lightTank', 1, 0, 0, '', 0),
+         (12, 'b', 'lightTank', 2, 50, 2000, '', 0)]
+LINKS = [(1, 2), (1, 3), (2, 4), (3, 4), (4, 5), (11, 12)]
+
+
+class TechGraphTest(unittest.TestCase):
+    def setUp(self):
+        tanks = []
+        for tank_id, nation, type, tier, xp, credits, premium, gold in TANKS:
+            tanks.append({'tank_id': tank_id, 'nation': nation, 'type': type, 'tier': tier,
+                          'price_xp': xp, 'price_credit': credits, 'price_gold': gold,
+                          'is_premium': premium, 'is_gift': ''})
+        self.graph = wot.TechGraph(tanks, LINKS)
+
+    def test_remaining(self):
+        # A tank with two parents is reached through the cheapest one
+        costs = self.graph.remaining(set())
+        self.assertEqual(costs[4], (1100, 11000))
+        self.assertEqual(costs[5], (4100, 41000))
+        self.assertIsNone(costs[6])
+        self.assertIsNone(costs[7])
+        self.assertEqual(self.graph.remaining({3}, [5]), {5: (4000, 40000)})
+
+    def test_path(self):
+        self.assertEqual(self.graph.path(5, set()), [1, 2, 4, 5])
+        self.assertEqual(self.graph.path(5, {3}), [4, 5])
+        self.assertEqual(self.graph.path(5, {1, 2}), [4, 5])
+        self.assertEqual(self.graph.path(5, {4}), [5])
+        self.assertEqual(self.graph.path(5, {5}), [])
+        self.assertEqual(self.graph.path(6, set()), [])
+        self.assertEqual(self.graph.path(7, set()), [])
+
+    def test_blockers(self):
+        self.assertEqual(self.graph.blockers(5, set()), [1, 2, 4])
+        self.assertEqual(self.graph.blockers(5, {3}), [4])
+        self.assertEqual(self.graph.blockers(4, {2}), [])
+        self.assertEqual(self.graph.blockers(6, set()), [])
+
+    def test_nearest(self):
+        # The premium and orphan tanks are never proposed
+        self.assertEqual(self.graph.nearest(set()), [1, 11])
+        self.assertEqual(self.graph.nearest({1}), [11, 2, 3])
+        self.assertEqual(self.graph.nearest({1, 3, 11}), [12, 2, 4])
+        self.assertEqual(self.graph.nearest({1, 2, 3, 4, 5, 11, 12}), [])
+
+    def test_goal(self):
+        self.assertEqual(self.graph.goal(set(), 2), (12, (50, 2000)))
+        self.assertEqual(self.graph.goal(set(), 2, nation='a'), (2, (100, 1000)))
+        self.assertEqual(self.graph.goal(set(), 2, type='mediumTank'), (3, (200, 500)))
+        self.assertEqual(self.graph.goal({3}, 3), (4, (1000, 10000)))
+        self.assertEqual(self.graph.goal({4}, 3), (4, (0, 0)))
+        self.assertIsNone(self.graph.goal(set(), 8))
+        self.assertIsNone(self.graph.goal(set(), 5))
+        self.assertIsNone(self.graph.goal(set(), 2, nation='a', type='heavyTank'))
+
+
+if __name__ == '__main__':
+    unittest.main()
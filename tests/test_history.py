@@ -0,0 +1,81 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import os
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+import wot
+
+
+# Constants
+ACCOUNT_ID = 500000001
+
+
+class _FakeTransport():
+    # API answering the current activity and tanks of a single player, changed by the test between the refreshes
+    def __init__(self):
+        self.last_battle_time = 0
+        self.tanks = {}
+
+    def fetch(self, tld, method, params):
+        if method == 'account/info':
+            data = {str(ACCOUNT_ID): {'nickname': 'Player1', 'last_battle_time': self.last_battle_time, 'updated_at': self.last_battle_time}}
+        elif method == 'account/tanks':
+            data = {str(ACCOUNT_ID): [{'tank_id': k, 'statistics': {'battles': v[0], 'wins': v[1]}, 'mark_of_mastery': 0} for k, v in self.tanks.items()]}
+        else:
+            return None
+        return json.dumps({'status': 'ok', 'data': data}).encode('utf-8')
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='wot-test-')
+        self.transport = _FakeTransport()
+        self.tree = wot.WotTree(self.transport, os.path.join(self.folder, 'wot.db'))
+        self.tree.tld = 'eu'
+        self.tree.account_id = ACCOUNT_ID
+
+    def tearDown(self):
+        self.tree.db.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def refresh(self, last_battle_time, tanks):
+        self.transport.last_battle_time = last_battle_time
+        self.transport.tanks = tanks
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.tree.cache_player(refresh=True))
+
+    def battles(self, as_of=None):
+        history = self.tree.get_history(as_of)
+        return dict([(k, history[k]['battles']) for k in history])
+
+    def test_history(self):
+        # The first snapshot is known at any time, and the later changes from the last battle of the player
+        self.refresh(1000, {1: (10, 5), 2: (5, 1)})
+        self.refresh(2000, {1: (15, 8), 2: (5, 1), 3: (3, 2)})
+        self.assertEqual(self.battles(), {1: 15, 2: 5, 3: 3})
+        self.assertEqual(self.battles(0), {1: 10, 2: 5})
+        self.assertEqual(self.battles(1500), {1: 10, 2: 5})
+        self.assertEqual(self.battles(2000), {1: 15, 2: 5, 3: 3})
+
+    def test_progress(self):
+        # The tanks of the first snapshot are never new, even before the first refresh
+        self.refresh(1000, {1: (10, 5), 2: (5, 1)})
+        self.assertEqual(self.tree.get_progress(500), {})
+        self.refresh(2000, {1: (15, 8), 2: (5, 1), 3: (3, 2)})
+        expected = {1: {'battles': 5, 'wins': 3, 'new': False},
+                    3: {'battles': 3, 'wins': 2, 'new': True}}
+        self.assertEqual(self.tree.get_progress(500), expected)
+        self.assertEqual(self.tree.get_progress(1500), expected)
+        self.assertEqual(self.tree.get_progress(500, 1500), {})
+        self.assertEqual(self.tree.get_progress(2000), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
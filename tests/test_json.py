@@ -0,0 +1,49 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import json
+import unittest
+from unittest import mock
+
+import wot
+
+
+# Constants
+DOCUMENT = {'status': 'ok',
+            'meta': {'count': 3, 'page_total': None},
+            'data': {'1': {'name': 'T-34', 'tier': 5, 'win_rate': 12.5, 'damage': -1.25e+3, 'ratio': 3E-2, 'premium': False},
+                     '17': {'name': 'Löwe «Char» ★ "quoted" \\ \n', 'tier': 8, 'win_rate': 0.0, 'next': [1, 2, 3], 'premium': True},
+                     '257': None,
+                     '4097': {'name': '', 'tier': 10, 'win_rate': 100, 'next': [], 'modules': {}, 'xp': 1234567890123}}}
+
+
+class JsonStreamTest(unittest.TestCase):
+    def read(self, data, chunk):
+        with mock.patch.object(wot, 'API_CHUNK', chunk):
+            response = wot.ApiResponse(data)
+            return list(response), response.status
+
+    def test_split(self):
+        # Every byte offset is the end of the first piece once, cutting the numbers, strings and literals anywhere
+        for indent in [None, 1]:
+            data = json.dumps(DOCUMENT, indent=indent, ensure_ascii=False).encode('utf-8')
+            for chunk in range(1, len(data) + 1):
+                with self.subTest(indent=indent, chunk=chunk):
+                    self.assertEqual(self.read(data, chunk), (list(DOCUMENT['data'].items()), 'ok'))
+
+    def test_list(self):
+        data = b'{"status":"ok","data":[1.5,-2e3,{"a":[]},"x"]}'
+        for chunk in range(1, len(data) + 1):
+            with self.subTest(chunk=chunk):
+                self.assertEqual(self.read(data, chunk), ([(0, 1.5), (1, -2e3), (2, {'a': []}), (3, 'x')], 'ok'))
+
+    def test_invalid(self):
+        data = json.dumps(DOCUMENT).encode('utf-8')
+        for end in range(len(data)):
+            with self.subTest(end=end):
+                self.assertEqual(self.read(data[:end], 7)[1], 'invalid')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import os
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+from time import time
+
+import wot
+
+
+# Constants
+ACCOUNT_IDS = list(range(500000000, 500000300))
+
+
+class _FakeTransport():
+    # API of a roster playing one more battle on a single tank each night, with the calls of account/tanks to reject
+    def __init__(self):
+        self.night = 1
+        self.failing = set()
+        self.calls = {}
+
+    def fetch(self, tld, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        account_ids = params['account_id'].split(',')
+        if method == 'account/info':
+            data = dict([(k, {'nickname': 'Player%s' % k, 'last_battle_time': 1000 * self.night, 'updated_at': 1000 * self.night}) for k in account_ids])
+        elif method == 'account/tanks':
+            if account_ids[0] in self.failing:
+                return json.dumps({'status': 'error', 'error': {'message': 'SOURCE_NOT_AVAILABLE'}}).encode('utf-8')
+            data = dict([(k, [{'tank_id': 1, 'statistics': {'battles': self.night, 'wins': 1}, 'mark_of_mastery': 0}]) for k in account_ids])
+        else:
+            return None
+        return json.dumps({'status': 'ok', 'data': data}).encode('utf-8')
+
+
+class PlayersTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='wot-test-')
+        self.transport = _FakeTransport()
+        self.tree = wot.WotTree(self.transport, os.path.join(self.folder, 'wot.db'))
+        self.tree.tld = 'eu'
+
+    def tearDown(self):
+        self.tree.db.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def refresh(self, night, failing=None):
+        self.transport.night = night
+        self.transport.failing = set([str(k) for k in failing or []])
+        self.transport.calls = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.tree.cache_players(ACCOUNT_IDS, refresh=True)
+
+    def battles(self):
+        return [row[0] for row in self.tree.sql.execute(''' SELECT battles
+                                                             FROM players_tanks
+                                                             ORDER BY account_id ''')]
+
+    def checkpoints(self):
+        return self.tree.sql.execute('SELECT COUNT(*) FROM checkpoints').fetchone()[0]
+
+    def test_idle(self):
+        # The idle players cost neither a call of account/tanks nor a write
+        self.assertTrue(self.refresh(1))
+        changes = self.tree.db.total_changes
+        self.assertTrue(self.refresh(1))
+        self.assertEqual(self.transport.calls, {'account/info': 3})
+        self.assertEqual(self.tree.db.total_changes, changes)
+
+    def test_resume(self):
+        # The interrupted refresh resumes with the failed batch only
+        self.assertTrue(self.refresh(1))
+        self.assertFalse(self.refresh(2, failing=[ACCOUNT_IDS[100]]))
+        self.assertEqual(self.checkpoints(), 2)
+        self.assertTrue(self.refresh(2))
+        self.assertEqual(self.transport.calls, {'account/info': 1, 'account/tanks': 1})
+        self.assertEqual(self.battles(), [2] * 300)
+        self.assertEqual(self.checkpoints(), 0)
+
+    def test_expired(self):
+        # A refresh long after the interrupted one starts over, the players having played again
+        self.assertTrue(self.refresh(1))
+        self.assertFalse(self.refresh(2, failing=[ACCOUNT_IDS[100]]))
+        self.tree.sql.execute('UPDATE checkpoints SET version = ?', (str(int(time()) - wot.PLAYERS_RESUME - 1), ))
+        self.tree.db.commit()
+        self.assertTrue(self.refresh(3))
+        self.assertEqual(self.transport.calls, {'account/info': 3, 'account/tanks': 3})
+        self.assertEqual(self.battles(), [3] * 300)
+        self.assertEqual(self.checkpoints(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# Copyright (C) 2021 ecrucru
+# https://github.com/ecrucru/wot-tree
+# AGPL version 3
+
+import threading
+import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import wot
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # The path starts with the status to answer, like /404/encyclopedia/info/
+    def do_GET(self):
+        self.server.calls += 1
+        status = int(self.path.split('/')[1])
+        body = b'{"status":"ok","data":{}}' if status == 200 else b'error'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.calls = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.patch = mock.patch.object(wot, 'API_BACKOFF', 0.001)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, status):
+        self.server.calls = 0
+        transport = wot.HttpTransport('http://127.0.0.1:%d/%d/' % (self.server.server_address[1], status), rate=1000)
+        return transport.fetch('eu', 'encyclopedia/info', {}), self.server.calls
+
+    def test_retries(self):
+        self.assertEqual(self.fetch(200), (b'{"status":"ok","data":{}}', 1))
+        for status in [400, 403, 404]:
+            with self.subTest(status=status):
+                self.assertEqual(self.fetch(status), (None, 1))
+        for status in [429, 500, 503]:
+            with self.subTest(status=status):
+                self.assertEqual(self.fetch(status), (None, wot.API_RETRIES + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,19 +6,101 @@ import sys
 import os
 import argparse
 import sqlite3
-from urllib.request import Request, urlopen
-from urllib.parse import urlencode
-from time import sleep
+import threading
+import subprocess
+import hashlib
+import http.client
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlparse, parse_qs, unquote
+from time import sleep, monotonic, time, perf_counter, process_time, localtime, strftime
+from datetime import datetime
 import json
+import gzip
+import re
+import csv
+import random
+import codecs
+import contextlib
+import functools
+import cProfile
+try:
+    import cairosvg                                 # Optional, to convert the native SVG into PNG
+except (ImportError, OSError):
+    cairosvg = None
 
 
 # Constants
 APP_ID = ''                                         # Register at WarGaming with your phone to get an application ID
 UNICODE_FONT = 'Segoe UI Symbol'                    # Pick according to your local computer
 MAX_TIER = 10
+SERVERS = ['eu', 'com', 'ru', 'asia']
+LANGUAGES = ['en', 'ru', 'pl', 'de', 'fr', 'es', 'zh-cn', 'zh-tw', 'tr', 'cs', 'th', 'vi', 'ko']
+API_URL = 'https://api.worldoftanks.%s/wot/'        # Base of the API, where %s is the realm
+API_RATE = 10                                       # Requests per second allowed per application ID
+API_THREADS = 8                                     # Parallel connections to the API
+API_BATCH = 100                                     # Maximal number of identifiers per API call
+API_CHUNK = 64 * 1024                               # Bytes of a response decoded at once
+API_RETRIES = 5                                     # Retries of a failed call, after 0.5, 1, 2, 4 and 8 seconds
+API_BACKOFF = 0.5                                   # Seconds before the first retry, doubled at each retry
+API_RECOVERY = 30                                   # Seconds for the rate to get back to normal after a throttling
+API_RETRY_ERRORS = ['REQUEST_LIMIT_EXCEEDED', 'SOURCE_NOT_AVAILABLE']
+SAVE_INTERVAL = 1                                   # Seconds of work committed at once, and lost at most by an interrupted refresh
+PLAYERS_RESUME = 6 * 3600                           # Seconds during which an interrupted refresh of a roster resumes, before it starts over
+SERVE_CACHE_SIZE = 64 * 1024 * 1024                 # Bytes of rendered pictures kept in memory by the server
+SERVE_TANKOPEDIA_CHECK = 3600                       # Seconds between two checks of the tankopedia by the server
+SERVE_PLAYER_CHECK = 300                            # Seconds between two checks of the activity of a player by the server
+MANIFEST_FILE = 'wot-manifest.json'                 # Fingerprints of the pictures generated in bulk
+SVG_FONT_SIZE = 12                                  # Layout of the native renderer, in pixels
+SVG_NODE_HEIGHT = 40
+SVG_NODE_PADDING = 10
+SVG_ROW = 80
+SVG_GAP = 16
+SVG_MARGIN = 10
+SVG_TIER_WIDTH = 50
+SVG_CLUSTER_LABEL = 30
+SVG_CLUSTER_PADDING = 12
+SVG_TITLE = 50
+TANK_FIELDS = ','.join(['tank_id', 'type', 'nation', 'tier', 'tag', 'name', 'is_premium', 'is_gift', 'is_wheeled',
+                        'default_profile.hp', 'price_credit', 'price_gold', 'prices_xp', 'next_tanks',
+                        'modules_tree.is_default', 'modules_tree.price_xp', 'modules_tree.price_credit'])
+TANK_NAME_FIELDS = 'tank_id,tag,name'               # Enough to add a language to a known realm
+
+
+# Database schema, one list of queries per version
+SCHEMA = [['CREATE TABLE "tanks" ("tank_id" INTEGER NOT NULL, "type" TEXT NOT NULL, "nation" TEXT NOT NULL, "tier" INTEGER NOT NULL, "tag" TEXT NOT NULL, "name" TEXT NOT NULL, "is_premium" TEXT NOT NULL, "is_gift" TEXT NOT NULL, "is_wheeled" TEXT NOT NULL, "hp" INTEGER NOT NULL, "price_xp" INTEGER NOT NULL, "price_credit" INTEGER NOT NULL, "price_gold" INTEGER NOT NULL, "elite_equipment_xp" INTEGER NOT NULL, "elite_equipment_cost" INTEGER NOT NULL, "elite_tanks_xp" INTEGER NOT NULL, "description" TEXT NOT NULL, "url" TEXT NOT NULL, PRIMARY KEY("tank_id"))',
+           'CREATE TABLE "tanks_tree" ("tank_id" INTEGER NOT NULL, "next_tank_id" INTEGER NOT NULL, PRIMARY KEY("next_tank_id","tank_id"))',
+           'CREATE TABLE "players" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "name" TEXT NOT NULL, PRIMARY KEY("account_id","server"))',
+           'CREATE TABLE "players_tanks" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "tank_id" INTEGER NOT NULL, "battles" INTEGER NOT NULL, "wins" INTEGER NOT NULL, "mastery" INTEGER NOT NULL, "win_rate" REAL NOT NULL, PRIMARY KEY("tank_id","account_id","server"))'],
+          ['ALTER TABLE "players" ADD COLUMN "last_battle_time" INTEGER NOT NULL DEFAULT 0',
+           'ALTER TABLE "players" ADD COLUMN "updated_at" INTEGER NOT NULL DEFAULT 0'],
+          ['CREATE TABLE "settings" ("key" TEXT NOT NULL, "value" TEXT NOT NULL, PRIMARY KEY("key"))'],
+          ['CREATE INDEX "players_tanks_account" ON "players_tanks" ("server", "account_id", "tank_id")',
+           'CREATE INDEX "players_name" ON "players" ("server", LOWER("name"))'],
+          ['DROP TABLE "tanks"',                    # The former tankopedia has no realm, so it is fetched again
+           'DROP TABLE "tanks_tree"',
+           'DELETE FROM "settings" WHERE "key" = \'tankopedia_version\'',
+           'CREATE TABLE "tanks" ("server" TEXT NOT NULL, "tank_id" INTEGER NOT NULL, "type" TEXT NOT NULL, "nation" TEXT NOT NULL, "tier" INTEGER NOT NULL, "tag" TEXT NOT NULL, "is_premium" TEXT NOT NULL, "is_gift" TEXT NOT NULL, "is_wheeled" TEXT NOT NULL, "hp" INTEGER NOT NULL, "price_xp" INTEGER NOT NULL, "price_credit" INTEGER NOT NULL, "price_gold" INTEGER NOT NULL, "elite_equipment_xp" INTEGER NOT NULL, "elite_equipment_cost" INTEGER NOT NULL, "elite_tanks_xp" INTEGER NOT NULL, PRIMARY KEY("tank_id","server"))',
+           'CREATE TABLE "tanks_names" ("server" TEXT NOT NULL, "language" TEXT NOT NULL, "tank_id" INTEGER NOT NULL, "name" TEXT NOT NULL, "description" TEXT NOT NULL, "url" TEXT NOT NULL, PRIMARY KEY("tank_id","server","language"))',
+           'CREATE TABLE "tanks_tree" ("server" TEXT NOT NULL, "tank_id" INTEGER NOT NULL, "next_tank_id" INTEGER NOT NULL, PRIMARY KEY("next_tank_id","tank_id","server"))'],
+          ['CREATE TABLE "players_history" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "tank_id" INTEGER NOT NULL, "time" INTEGER NOT NULL, "battles" INTEGER NOT NULL, "wins" INTEGER NOT NULL, "mastery" INTEGER NOT NULL, PRIMARY KEY("server","account_id","tank_id","time")) WITHOUT ROWID',
+           'INSERT INTO "players_history" SELECT a."server", a."account_id", a."tank_id", IFNULL(b."last_battle_time", 0), a."battles", a."wins", a."mastery" FROM "players_tanks" AS a LEFT OUTER JOIN "players" AS b ON b."server" = a."server" AND b."account_id" = a."account_id"'],
+          ['CREATE TABLE "tanks_summary" ("server" TEXT NOT NULL, "tank_id" INTEGER NOT NULL, "players" INTEGER NOT NULL, "battles" INTEGER NOT NULL, "wins" INTEGER NOT NULL, PRIMARY KEY("tank_id","server"))',
+           'CREATE TABLE "players_summary" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "nation" TEXT NOT NULL, "type" TEXT NOT NULL, "tanks" INTEGER NOT NULL, "max_tier" INTEGER NOT NULL, "battles" INTEGER NOT NULL, "wins" INTEGER NOT NULL, PRIMARY KEY("server","account_id","nation","type")) WITHOUT ROWID',
+           'CREATE INDEX "players_summary_line" ON "players_summary" ("server", "nation", "type", "max_tier")',
+           'INSERT INTO "tanks_summary" SELECT "server", "tank_id", COUNT(*), SUM("battles"), SUM("wins") FROM "players_tanks" GROUP BY "server", "tank_id"',
+           'INSERT INTO "players_summary" SELECT a."server", a."account_id", b."nation", b."type", COUNT(*), MAX(b."tier"), SUM(a."battles"), SUM(a."wins") FROM "players_tanks" AS a INNER JOIN "tanks" AS b ON b."server" = a."server" AND b."tank_id" = a."tank_id" GROUP BY a."server", a."account_id", b."nation", b."type"'],
+          ['CREATE TABLE "checkpoints" ("task" TEXT NOT NULL, "version" TEXT NOT NULL, "batch" TEXT NOT NULL, PRIMARY KEY("task","batch")) WITHOUT ROWID'],
+          ['UPDATE "players_history" SET "time" = 0 WHERE "time" = (SELECT MIN(b."time") FROM "players_history" AS b WHERE b."server" = "players_history"."server" AND b."account_id" = "players_history"."account_id")']]
 
 
 # Useful functions
+_JSON = json.JSONDecoder()
+_JSON_SPACE = re.compile(r'[ \t\n\r]*')
+_JSON_NUMBER = '0123456789.eE+-'                    # Characters that may continue a number cut between two pieces
+
+
 def _int(value):
     try:
         return int(value)
@@ -56,37 +138,570 @@ def _field(data, path, default=''):
     return default if value in [None, ''] else value
 
 
-def _rf(cursor, row):
-    # https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.row_factory
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+def _timestamp(value):
+    # Local date and optional time
+    return int(datetime.fromisoformat(value).timestamp())
 
 
-class WotTree():
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _api_error(data):
+    # Message of an error returned by the API, the successful responses being large and rarely fully decoded here
+    if b'"error"' not in data:
+        return ''
+    try:
+        data = json.loads(data.decode('utf-8'))
+    except ValueError:
+        return ''
+    if _field(data, 'status') != 'error':
+        return ''
+    return _field(data, 'error/message')
+
+
+def _svg_text(value):
+    # Escape for XML, but keep the numeric entities used in the labels
+    value = re.sub(r'&(?!#x?[0-9A-Fa-f]+;)', '&amp;', value)
+    return value.replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _svg_width(value):
+    # Approximate width of a text, each entity being a single glyph
+    return int(0.6 * SVG_FONT_SIZE * len(re.sub(r'&#x?[0-9A-Fa-f]+;', '_', value)))
+
+
+def _render_dot(source, target):
+    # Called in a separate process for the bulk rendering
+    ext = target.split('.')[-1].strip().lower()
+    if ext not in ['png', 'jpg', 'svg', 'ps', 'json']:
+        return False
+    try:
+        return subprocess.run(['dot', '-T%s' % ext, source, '-o', target]).returncode == 0
+    except OSError:
+        return False
+
+
+def _render_svg(buffer, target):
+    # Called in a separate process for the bulk rendering
+    ext = target.split('.')[-1].strip().lower()
+    try:
+        if ext == 'svg':
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(buffer)
+        elif ext == 'png' and cairosvg is not None:
+            cairosvg.svg2png(bytestring=buffer.encode('utf-8'), write_to=target)
+        else:
+            return False
+    except Exception:
+        return False
+    return True
+
+
+class WotStats():
+    # Counters of the process, with the time spent in each phase
     def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()
+        self.phases = OrderedDict()
+        self.profiler = None
+        self.depth = 0
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name, db=None):
+        # The profiler only runs during the outermost phase
+        if self.profiler is not None and self.depth == 0:
+            self.profiler.enable()
+        self.depth += 1
+        rows = db.total_changes if db is not None else 0
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = perf_counter() - wall, process_time() - cpu
+            self.depth -= 1
+            if self.profiler is not None and self.depth == 0:
+                self.profiler.disable()
+            with self.lock:
+                entry = self.phases.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0})
+                entry['calls'] += 1
+                entry['wall_seconds'] += wall
+                entry['cpu_seconds'] += cpu
+                entry['rows'] += (db.total_changes - rows) if db is not None else 0
+
+    def to_json(self):
+        with self.lock:
+            return json.dumps({'phases': self.phases, 'counters': self.counters}, indent=1)
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for key, kind in [('calls', 'counter'), ('wall_seconds', 'counter'), ('cpu_seconds', 'counter'), ('rows', 'counter')]:
+                lines.append('# TYPE wot_phase_%s_total %s' % (key, kind))
+                for name in self.phases:
+                    lines.append('wot_phase_%s_total{phase="%s"} %s' % (key, name, self.phases[name][key]))
+            for name in self.counters:
+                lines.append('# TYPE wot_%s_total counter' % name)
+                lines.append('wot_%s_total %s' % (name, self.counters[name]))
+        return '\n'.join(lines) + '\n'
+
+
+STATS = WotStats()
+
+
+def _phase(name):
+    # Decorator measuring a method of WotTree
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with STATS.phase(name, self.db):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _JsonStream():
+    # Incremental reader of a JSON document, decoding one value at a time from pieces of the raw bytes
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+
+    def _more(self):
+        # The consumed text is dropped, and the read size grows with a long value to keep a linear time
+        if self.offset >= len(self.data):
+            return False
+        size = max(API_CHUNK, len(self.buffer) - self.pos)
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(self.data[self.offset:self.offset + size], self.offset + size >= len(self.data))
+        self.pos = 0
+        self.offset += size
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _JSON_SPACE.match(self.buffer, self.pos).end()
+            if (self.pos < len(self.buffer)) or not self._more():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if (char == '') or (char not in chars):
+            raise ValueError('Invalid JSON near the byte %d' % self.offset)
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _JSON.raw_decode(self.buffer, self.pos)
+                # A number may continue in the next piece, even after a valid prefix like "12." or "1e"
+                if (self.offset >= len(self.data)) or ((end < len(self.buffer)) and (self.buffer[end] not in _JSON_NUMBER)):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.offset >= len(self.data):
+                    raise
+            self._more()
+
+    def members(self):
+        # Keys of the object or indexes of the list at the current position, the caller reading each value
+        closing = '}' if self.expect('{[') == '{' else ']'
+        if self.peek() == closing:
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            if closing == '}':
+                key = self.value()
+                self.expect(':')
+            else:
+                key = index
+            yield key
+            index += 1
+            if self.expect(',' + closing) == closing:
+                return
+
+
+class ApiResponse():
+    # Response of the API whose "data" is decoded one member at a time, the status being known once read
+    def __init__(self, data):
+        self.stream = _JsonStream(data)
+        self.status = None
+
+    def __iter__(self):
+        # Pairs (key, value) of the "data" object, or (index, value) of the "data" list
+        try:
+            for key in self.stream.members():
+                if (key == 'data') and (self.stream.peek() in '{['):
+                    for subkey in self.stream.members():
+                        start = perf_counter()
+                        value = self.stream.value()
+                        STATS.count('json_seconds', perf_counter() - start)
+                        yield subkey, value
+                else:
+                    value = self.stream.value()
+                    if key == 'status':
+                        self.status = value
+        except ValueError:
+            self.status = 'invalid'
+
+    def ok(self):
+        # Read the rest of the response
+        for _ in self:
+            pass
+        return self.status == 'ok'
+
+
+class _RateLimiter():
+    # Token bucket shared by all the threads
+    # The rate is halved when the API complains, and it recovers linearly in API_RECOVERY seconds
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = monotonic()
+        self.throttled = monotonic() - 1
+        self.lock = threading.Lock()
+
+    def throttle(self):
+        with self.lock:
+            # The parallel calls rejected together count once
+            now = monotonic()
+            if now - self.throttled >= 1:
+                self.throttled = now
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+                self.tokens = min(self.tokens, 0)
+                STATS.count('rate_limit_throttles')
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.rate = min(self.max_rate, self.rate + (now - self.stamp) * self.max_rate / API_RECOVERY)
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            STATS.count('rate_limit_wait_seconds', delay)
+            sleep(delay)
+
+
+class HttpTransport():
+    def __init__(self, url=API_URL, rate=API_RATE):
+        self.url = url
+        self.limiter = _RateLimiter(rate, rate)
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _acquire_connection(self, scheme, host):
+        # Reuse a kept-alive connection of the realm when available
+        with self.lock:
+            pool = self.idle.setdefault((scheme, host), [])
+            if len(pool) > 0:
+                return pool.pop()
+        if scheme == 'http':
+            return http.client.HTTPConnection(host, timeout=30)
+        return http.client.HTTPSConnection(host, timeout=30)
+
+    def _release_connection(self, scheme, host, conn):
+        with self.lock:
+            self.idle[(scheme, host)].append(conn)
+
+    def _request(self, url, path):
+        # Response of a single call, or None when it failed, and whether the failure is worth a retry
+        for attempt in range(2):
+            conn = self._acquire_connection(url.scheme, url.netloc)
+            start = perf_counter()
+            try:
+                conn.request('GET', path, headers={'Connection': 'keep-alive',
+                                                   'Accept-Encoding': 'gzip'})
+                query = conn.getresponse()
+                data = query.read()
+            except (http.client.HTTPException, OSError):
+                # The server may have closed an idle connection, so retry once with a new one
+                conn.close()
+                STATS.count('http_errors')
+                if attempt == 0:
+                    continue
+                return None, True
+            STATS.count('http_requests')
+            STATS.count('http_bytes', len(data))
+            STATS.count('http_seconds', perf_counter() - start)
+            if query.status != 200 or query.will_close:
+                conn.close()
+            else:
+                self._release_connection(url.scheme, url.netloc, conn)
+            if query.status != 200:
+                STATS.count('http_errors')
+                if query.status == 429:
+                    self.limiter.throttle()
+                # The other client errors are permanent, like a wrong URL
+                return None, (query.status == 429) or (query.status >= 500)
+            if query.getheader('Content-Encoding', '') == 'gzip':
+                data = gzip.decompress(data)
+            return data, False
+        return None, True
+
+    def fetch(self, tld, method, params):
+        # The throttled calls, server errors and lost connections are retried with an exponential backoff
+        # The throttled ones also slow down the rate
+        url = urlparse('%s%s/?%s' % (self.url.replace('%s', tld), method, urlencode(params)))
+        path = '%s?%s' % (url.path, url.query)
+        data = None
+        for attempt in range(API_RETRIES + 1):
+            if attempt > 0:
+                delay = API_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                STATS.count('http_retries')
+                STATS.count('backoff_wait_seconds', delay)
+                sleep(delay)
+            self.limiter.acquire()
+            data, retry = self._request(url, path)
+            if data is None:
+                if retry:
+                    continue
+                return None
+            error = _api_error(data)
+            if error == 'REQUEST_LIMIT_EXCEEDED':
+                self.limiter.throttle()
+            if error not in API_RETRY_ERRORS:
+                return data
+        return data
+
+
+class DiskTransport():
+    # Cache with a TTL in seconds when "inner" is set, or replay of the recorded responses only
+    def __init__(self, folder, inner=None, ttl=None):
+        self.folder = folder
+        self.inner = inner
+        self.ttl = ttl
+
+    def _path(self, tld, method, params):
+        # The key ignores the application and the order of the parameters
+        query = urlencode(sorted([(k, str(params[k])) for k in params if k != 'application_id']))
+        return os.path.join(self.folder, tld, method.replace('/', '-'), '%s.json' % hashlib.sha256(query.encode('utf-8')).hexdigest()[:40])
+
+    def fetch(self, tld, method, params):
+        path = self._path(tld, method, params)
+        try:
+            if (self.ttl is None) or (time() - os.path.getmtime(path) < self.ttl):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                STATS.count('api_cache_hits')
+                return data
+        except OSError:
+            pass
+        STATS.count('api_cache_misses')
+        if self.inner is None:
+            return None
+
+        # Only the successful responses are stored
+        data = self.inner.fetch(tld, method, params)
+        try:
+            if (data is not None) and ApiResponse(data).ok():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+        return data
+
+
+class WotApi():
+    def __init__(self, transport=None):
+        self.transport = transport or HttpTransport()
+
+    def call(self, tld, method, params):
+        data = self.transport.fetch(tld, method, params)
+        if data is None:
+            return None
+        start = perf_counter()
+        data = json.loads(data.decode('utf-8'))
+        STATS.count('json_seconds', perf_counter() - start)
+        return data
+
+    def stream_many(self, tld, method, params_list):
+        # The responses are returned in the order of the parameters, with a few of them in memory
+        # A failed call gives a response without status
+        # The calls not started yet are dropped when the reading stops early
+        with ThreadPoolExecutor(max_workers=API_THREADS) as executor:
+            pending = deque()
+            try:
+                for params in params_list:
+                    pending.append(executor.submit(self.transport.fetch, tld, method, params))
+                    if len(pending) > 2 * API_THREADS:
+                        yield ApiResponse(pending.popleft().result() or b'')
+                while len(pending) > 0:
+                    yield ApiResponse(pending.popleft().result() or b'')
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class TechGraph():
+    # Index of the tech tree of a realm, with the ancestors and the cheapest cumulative costs of each tank
+    # A tank is researched from any of its parents, and the tanks out of the tree cannot be researched
+    def __init__(self, tanks, links):
+        self.tanks = {}
+        self.parents = {}
+        self.children = {}
+        for row in tanks:
+            tank_id = row['tank_id']
+            self.tanks[tank_id] = {'tier': row['tier'],
+                                   'nation': row['nation'],
+                                   'type': row['type'],
+                                   'xp': row['price_xp'],
+                                   'credits': row['price_credit'],
+                                   'researchable': row['tier'] == 1 and not (row['is_premium'] or row['is_gift'] or row['price_gold'] > 0)}
+            self.parents[tank_id] = []
+            self.children[tank_id] = []
+        for tank_id, next_tank_id in links:
+            if (tank_id in self.tanks) and (next_tank_id in self.tanks):
+                self.children[tank_id].append(next_tank_id)
+                self.parents[next_tank_id].append(tank_id)
+                self.tanks[next_tank_id]['researchable'] = True
+
+        self.prices = dict([(k, (self.tanks[k]['xp'], self.tanks[k]['credits']) if self.tanks[k]['researchable'] else None) for k in self.tanks])
+
+        # Topological order, the parents first
+        self.order = []
+        pending = dict([(k, len(self.parents[k])) for k in self.tanks])
+        ready = sorted([k for k in pending if pending[k] == 0], reverse=True)
+        while len(ready) > 0:
+            tank_id = ready.pop()
+            self.order.append(tank_id)
+            for k in self.children[tank_id]:
+                pending[k] -= 1
+                if pending[k] == 0:
+                    ready.append(k)
+
+        # Ancestors and cumulative costs from the first tier, by the cheapest parent
+        self.ancestors = {}
+        for tank_id in self.order:
+            ancestors = set(self.parents[tank_id])
+            for k in self.parents[tank_id]:
+                ancestors |= self.ancestors[k]
+            self.ancestors[tank_id] = frozenset(ancestors)
+        self.cumulative = self.remaining(set())
+
+    def remaining(self, owned, targets=None):
+        # XP and credits still needed per tank, or None when it cannot be researched
+        # The owned tanks are assumed researched, and the targets limit the work to their ancestors
+        if targets is None:
+            order = self.order
+        else:
+            scope = set([k for k in targets if k in self.tanks])
+            for k in list(scope):
+                scope |= self.ancestors[k]
+            order = [k for k in self.order if k in scope]
+        costs = {}
+        parents = self.parents
+        prices = self.prices
+        for tank_id in order:
+            if tank_id in owned:
+                costs[tank_id] = (0, 0)
+                continue
+            price = prices[tank_id]
+            best = None
+            if price is not None:
+                if len(parents[tank_id]) == 0:
+                    best = (0, 0)
+                for k in parents[tank_id]:
+                    cost = costs[k]
+                    if (cost is not None) and ((best is None) or (cost < best)):
+                        best = cost
+            costs[tank_id] = None if best is None else (best[0] + price[0], best[1] + price[1])
+        if targets is not None:
+            return dict([(k, costs.get(k)) for k in targets])
+        return costs
+
+    def path(self, tank_id, owned):
+        # Tanks still to research to reach a tank, in the order of the research
+        costs = self.remaining(owned, [tank_id] + list(self.ancestors.get(tank_id, [])))
+        result = []
+        while (tank_id is not None) and (tank_id not in owned) and (costs.get(tank_id) is not None):
+            result.append(tank_id)
+            parents = [k for k in self.parents[tank_id] if costs[k] is not None]
+            tank_id = min(parents, key=lambda k: (costs[k], k)) if len(parents) > 0 else None
+        return result[::-1]
+
+    def blockers(self, tank_id, owned):
+        # Tanks of the cheapest path that are not researched yet, the tank itself excluded
+        return self.path(tank_id, owned)[:-1]
+
+    def nearest(self, owned):
+        # Tanks that can be researched right now, the cheapest first
+        result = []
+        for tank_id in self.order:
+            tank = self.tanks[tank_id]
+            if (tank_id in owned) or not tank['researchable']:
+                continue
+            if (len(self.parents[tank_id]) == 0) or any([k in owned for k in self.parents[tank_id]]):
+                result.append(tank_id)
+        return sorted(result, key=lambda k: (self.tanks[k]['xp'], k))
+
+    def goal(self, owned, tier, nation=None, type=None):
+        # Cheapest tank of a tier, optionally for a nation and a type, with its remaining costs
+        targets = [k for k in self.order
+                   if (self.tanks[k]['tier'] == tier)
+                   and (nation in [None, self.tanks[k]['nation']])
+                   and (type in [None, self.tanks[k]['type']])]
+        costs = self.remaining(owned, targets)
+        targets = [k for k in targets if costs[k] is not None]
+        if len(targets) == 0:
+            return None
+        tank_id = min(targets, key=lambda k: (costs[k], k))
+        return tank_id, costs[tank_id]
+
+
+class WotTree():
+    def __init__(self, transport=None, database='wot.db'):
         # Variables
         self.tld = ''
         self.player = ''
         self.language = ''
         self.account_id = 0
+        self.api = WotApi(transport)
+        self.skeletons = {}
+        self.graphs = {}
 
         # Database
-        self.db = sqlite3.connect('wot.db')
-        self.db.row_factory = _rf
+        self.db = sqlite3.connect(database, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
         self.sql = self.db.cursor()
+        self.sql.execute('PRAGMA journal_mode = WAL')   # Readers in other processes are not blocked by the writer
+        self.sql.execute('PRAGMA synchronous = NORMAL')
+        self.sql.execute('PRAGMA temp_store = MEMORY')
+        self.sql.execute('PRAGMA cache_size = -20000')
 
-        # Initialize the tables
-        if self.sql.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchone() is None:
-            for q in ['CREATE TABLE "tanks" ("tank_id" INTEGER NOT NULL, "type" TEXT NOT NULL, "nation" TEXT NOT NULL, "tier" INTEGER NOT NULL, "tag" TEXT NOT NULL, "name" TEXT NOT NULL, "is_premium" TEXT NOT NULL, "is_gift" TEXT NOT NULL, "is_wheeled" TEXT NOT NULL, "hp" INTEGER NOT NULL, "price_xp" INTEGER NOT NULL, "price_credit" INTEGER NOT NULL, "price_gold" INTEGER NOT NULL, "elite_equipment_xp" INTEGER NOT NULL, "elite_equipment_cost" INTEGER NOT NULL, "elite_tanks_xp" INTEGER NOT NULL, "description" TEXT NOT NULL, "url" TEXT NOT NULL, PRIMARY KEY("tank_id"))',
-                      'CREATE TABLE "tanks_tree" ("tank_id" INTEGER NOT NULL, "next_tank_id" INTEGER NOT NULL, PRIMARY KEY("next_tank_id","tank_id"))',
-                      'CREATE TABLE "players" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "name" TEXT NOT NULL, PRIMARY KEY("account_id","server"))',
-                      'CREATE TABLE "players_tanks" ("server" TEXT NOT NULL, "account_id" INTEGER NOT NULL, "tank_id" INTEGER NOT NULL, "battles" INTEGER NOT NULL, "wins" INTEGER NOT NULL, "mastery" INTEGER NOT NULL, "win_rate" REAL NOT NULL, PRIMARY KEY("tank_id","account_id","server"))']:
-                self.sql.execute(q)
-            self.db.commit()
+        # Initialize or upgrade the tables
+        version = self.sql.execute('PRAGMA user_version').fetchone()['user_version']
+        if version == 0 and self.sql.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchone() is not None:
+            version = 1                             # Database created before the versioning of the schema
+        # Each step is a transaction with its version, because the changes of the tables are not in an implicit one
+        for step in range(version, len(SCHEMA)):
+            try:
+                self.sql.execute('BEGIN')
+                for q in SCHEMA[step]:
+                    self.sql.execute(q)
+                self.sql.execute('PRAGMA user_version = %d' % (step + 1))
+                self.db.commit()
+            except sqlite3.Error:
+                self.db.rollback()
+                raise
 
-    def set_parameters(self, server='', player='', language=''):
+    def set_parameters(self, server='', player='', language='', batch=False):
         # Default values
         self.tld = server
         self.player = player
@@ -100,7 +715,7 @@ class WotTree():
                 self.tld = 'com'
 
         # Player name
-        if self.player == '':
+        if self.player == '' and not batch:
             print('Name of the player = ', end='')
             self.player = input().strip()
 
@@ -112,337 +727,860 @@ class WotTree():
                 self.language = 'en'
 
         # Result
-        return self.tld in ['eu', 'com', 'ru', 'asia'] \
-            and self.player != '' \
-            and self.language in ['en', 'ru', 'pl', 'de', 'fr', 'es', 'zh-cn', 'zh-tw', 'tr', 'cs', 'th', 'vi', 'ko']
+        return self.tld in SERVERS \
+            and (self.player != '' or batch) \
+            and self.language in LANGUAGES
 
     def search_player(self, refresh=False):
+        accounts = self.search_players([self.player], refresh=refresh)
+        if (accounts is None) or (len(accounts) != 1):
+            return False
+        self.account_id = list(accounts.values())[0]
+        return True
+
+    @_phase('search_players')
+    def search_players(self, names, refresh=False):
+        # Accounts of the players found, or None when a call failed, the found ones being saved anyway
         # Query the database
-        if not refresh:
-            self.sql.execute(''' SELECT account_id
-                                 FROM players
-                                 WHERE server      = ?
-                                   AND LOWER(name) = ? ''',
-                             (self.tld, self.player.lower()))
-            row = self.sql.fetchone()
+        accounts = {}
+        missing = []
+        for name in names:
+            row = None
+            if not refresh:
+                self.sql.execute(''' SELECT account_id
+                                     FROM players
+                                     WHERE server      = ?
+                                       AND LOWER(name) = ? ''',
+                                 (self.tld, name.lower()))
+                row = self.sql.fetchone()
             if row is not None:
-                self.account_id = row['account_id']
-                return True
-
-        # Call the API
-        params = {'application_id': APP_ID,
-                  'search': self.player,
-                  'language': self.language,
-                  'limit': 1,
-                  'type': 'exact'}
-        url = 'https://api.worldoftanks.%s/wot/account/list/?%s' % (self.tld, urlencode(params))
-        query = urlopen(Request(url, None, method='GET'))
-        if query.status == 200:
-            data = query.read().decode('utf-8')
-        else:
-            return False
+                accounts[name] = row['account_id']
+            else:
+                missing.append(name)
+        if len(missing) == 0:
+            return accounts
 
-        # Parse the data
-        data = json.loads(data)
-        if (_field(data, 'status') != 'ok') or (len(_field(data, 'data')) != 1):
-            return False
-        self.account_id = _field(data, 'data/[0]/account_id')
+        # Call the API by batches of names
+        batches = []
+        for chunk in _chunks(missing, API_BATCH):
+            batches.append({'application_id': APP_ID,
+                            'search': ','.join(chunk),
+                            'fields': 'nickname,account_id',
+                            'limit': API_BATCH,
+                            'type': 'exact'})
+        found = {}
+        failed = False
+        for response in self.api.stream_many(self.tld, 'account/list', batches):
+            entries = {}
+            for _, entry in response:
+                entries[_field(entry, 'nickname').lower()] = _field(entry, 'account_id', 0)
+            if response.status == 'ok':
+                found.update(entries)
+            else:
+                failed = True
 
         # Cache the result
-        self.sql.execute(''' INSERT OR REPLACE INTO players
-                             (server, account_id, name)
-                             VALUES (?, ?, ?) ''',
-                         (self.tld, self.account_id, self.player))
+        rows = []
+        for name in missing:
+            if name.lower() in found:
+                accounts[name] = found[name.lower()]
+                rows.append((self.tld, accounts[name], name))
+        # The activity of a known player is kept, so that a refresh stays incremental
+        self.sql.executemany(''' INSERT INTO players
+                                 (server, account_id, name)
+                                 VALUES (?, ?, ?)
+                                 ON CONFLICT (account_id, server) DO UPDATE
+                                 SET name = excluded.name ''', rows)
         self.db.commit()
-        return True
+        return None if failed else accounts
+
+    def get_setting(self, key, default=''):
+        row = self.sql.execute(''' SELECT value
+                                   FROM settings
+                                   WHERE key = ? ''',
+                               (key, )).fetchone()
+        return default if row is None else row['value']
+
+    def set_setting(self, key, value):
+        self.sql.execute(''' INSERT OR REPLACE INTO settings
+                             (key, value)
+                             VALUES (?, ?) ''',
+                         (key, str(value)))
+
+    def get_version(self, language=None):
+        # Version of the tankopedia of the realm, or of its strings in a language
+        if language is None:
+            return self.get_setting('tankopedia_version/%s' % self.tld)
+        return self.get_setting('tankopedia_version/%s/%s' % (self.tld, language))
+
+    def get_checkpoints(self, task, version):
+        # Batches saved by an interrupted run of the same version, the other ones being forgotten
+        self.sql.execute(''' DELETE FROM checkpoints
+                             WHERE task     = ?
+                               AND version <> ? ''',
+                         (task, version))
+        self.sql.execute(''' SELECT batch
+                             FROM checkpoints
+                             WHERE task = ? ''',
+                         (task, ))
+        return set([row['batch'] for row in self.sql.fetchall()])
 
+    def set_checkpoint(self, task, version, batch):
+        self.sql.execute(''' INSERT OR REPLACE INTO checkpoints
+                             (task, version, batch)
+                             VALUES (?, ?, ?) ''',
+                         (task, version, batch))
+
+    @_phase('cache_tanks')
     def cache_tanks(self, refresh=False):
-        # Connect to the database
-        if refresh:
-            self.sql.execute('DELETE FROM tanks')
-            self.sql.execute('DELETE FROM tanks_tree')
-        elif self.sql.execute(''' SELECT tank_id
-                                  FROM tanks
-                                  LIMIT 1 ''').fetchone() is not None:
+        # Check the version of the tankopedia with a single cheap call
+        info = self.api.call(self.tld, 'encyclopedia/info', {'application_id': APP_ID,
+                                                             'fields': 'tanks_updated_at,game_version',
+                                                             'language': self.language})
+        version = '%s/%s' % (_field(info, 'data/tanks_updated_at'), _field(info, 'data/game_version'))
+        current = {}
+        for language in [None, self.language]:
+            current[language] = self.get_version(language) != ''
+            if _field(info, 'status') == 'ok':
+                current[language] = current[language] and (version == self.get_version(language))
+        if not refresh and current[None] and current[self.language]:
             return True
-        print('Fetching all the tanks once... (estimated time: 1 minute)')
+
+        # Each realm and language is refreshed on its own, and a new language of a known realm only needs the names
+        names_only = not refresh and current[None]
+        if names_only:
+            print('Fetching the names of the tanks...')
+        else:
+            print('Fetching all the tanks...')
 
         # Fetch the tanks by small batches of assumedly less than 100 entries
-        tanks = []
-        tanks_tree = []
+        batches = []
         for tier in range(MAX_TIER):
             for type in ['heavyTank', 'AT-SPG', 'mediumTank', 'lightTank', 'SPG']:
-                sleep(1)
-
-                # Call the API
-                params = {'application_id': APP_ID,
-                          'language': self.language,
-                          'tier': tier + 1,
-                          'type': type}
-                url = 'https://api.worldoftanks.%s/wot/encyclopedia/vehicles/?%s' % (self.tld, urlencode(params))
-                query = urlopen(Request(url, None, method='GET'))
-                if query.status == 200:
-                    data = query.read().decode('utf-8')
-                    data = json.loads(data)
-                    if _field(data, 'status') != 'ok':
-                        return False
-                    alldata = data['data']
-
-                    # Analyze each tank
-                    for tid in alldata:
-                        data = alldata[tid]
-
-                        # Tank main properties
-                        entry = {'tank_id': _field(data, 'tank_id', 0),
-                                 'type': _field(data, 'type'),
-                                 'nation': _field(data, 'nation'),
-                                 'tier': _field(data, 'tier', 0),
-                                 'tag': _field(data, 'tag'),
-                                 'name': _field(data, 'name'),
-                                 'is_premium': _bool(_field(data, 'is_premium')),
-                                 'is_gift': _bool(_field(data, 'is_gift')),
-                                 'is_wheeled': _bool(_field(data, 'is_wheeled')),
-                                 'hp': _field(data, 'default_profile/hp'),
-                                 'price_xp': 0,
-                                 'price_credit': _field(data, 'price_credit', 0),
-                                 'price_gold': _field(data, 'price_gold', 0),
-                                 'elite_equipment_xp': 0,
-                                 'elite_equipment_cost': 0,
-                                 'elite_tanks_xp': 0,
-                                 'description': _field(data, 'description'),
-                                 'url': ''}
-
-                        # Parent tank to deduct tank XP (inaccurate for SU-152 that has 2 parents)
-                        subdata = _field(data, 'prices_xp')
-                        for nid in subdata:
-                            entry['price_xp'] = subdata[nid]
-                            break
-
-                        # Modules XP & cost
-                        subdata = _field(data, 'modules_tree')
-                        for nid in subdata:
-                            if not _bool(_field(subdata[nid], 'is_default')):
-                                entry['elite_equipment_xp'] += _field(subdata[nid], 'price_xp', 0)
-                                entry['elite_equipment_cost'] += _field(subdata[nid], 'price_credit', 0)
-
-                        # Tanks tree
-                        subdata = _field(data, 'next_tanks')
-                        for nid in subdata:
-                            tanks_tree.append((entry['tank_id'], _int(nid)))
-                            entry['elite_tanks_xp'] += subdata[nid]
-
-                        # Entry
-                        entry['url'] = 'https://worldoftanks.%s/%s/tankopedia/%d-%s/' % (self.tld, self.language, entry['tank_id'], entry['tag'])
-                        tanks.append(entry)
-
-        # Save to database
-        for entry in tanks:
-            self.sql.execute(''' INSERT INTO tanks
-                                 (tank_id, type, nation, tier, tag, name, is_premium, is_gift,
-                                  is_wheeled, hp, price_xp, price_credit, price_gold,
-                                  elite_equipment_xp, elite_equipment_cost, elite_tanks_xp,
-                                  description, url)
-                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ''', _o2t(entry))
-        for entry in tanks_tree:
-            self.sql.execute(''' INSERT INTO tanks_tree
-                                 (tank_id, next_tank_id)
-                                 VALUES (?, ?) ''', entry)
+                batches.append({'application_id': APP_ID,
+                                'fields': TANK_NAME_FIELDS if names_only else TANK_FIELDS,
+                                'language': self.language,
+                                'tier': tier + 1,
+                                'type': type})
+
+        # The batches already saved by an interrupted run of the same version are skipped
+        task = 'encyclopedia/vehicles/%s/%s/%s' % (self.tld, self.language, 'names' if names_only else 'tanks')
+        resumable = _field(info, 'status') == 'ok'
+        done = self.get_checkpoints(task, version if resumable and not refresh else '')
+        batches = [params for params in batches if '%(tier)d/%(type)s' % params not in done]
+
+        # Compare with the current tankopedia while the tanks are read
+        known = {}
+        self.sql.execute(''' SELECT tank_id, type, nation, tier, tag, is_premium, is_gift,
+                                    is_wheeled, hp, price_xp, price_credit, price_gold,
+                                    elite_equipment_xp, elite_equipment_cost, elite_tanks_xp
+                             FROM tanks
+                             WHERE server = ? ''',
+                         (self.tld, ))
+        for row in self.sql.fetchall():
+            known[row['tank_id']] = tuple(row)
+        known_names = {}
+        self.sql.execute(''' SELECT tank_id, name, url
+                             FROM tanks_names
+                             WHERE server   = ?
+                               AND language = ? ''',
+                         (self.tld, self.language))
+        for row in self.sql.fetchall():
+            known_names[row['tank_id']] = tuple(row)
+        known_tree = set([(row['tank_id'], row['next_tank_id']) for row in self.sql.execute(''' SELECT tank_id, next_tank_id
+                                                                                                FROM tanks_tree
+                                                                                                WHERE server = ? ''',
+                                                                                            (self.tld, )).fetchall()])
+
+        # Save the differences to database batch after batch, each one being committed with its checkpoint
+        # A batch only compares the tanks of its tier and type, so a failed batch does not stop the other ones
+        # The descriptions are not used, so they are not requested and their column stays empty
+        changed = len(done) > 0
+        failed = False
+        try:
+            for params, response in zip(batches, self.api.stream_many(self.tld, 'encyclopedia/vehicles', batches)):
+                tank_ids = set()
+                tanks_tree = set()
+                entries = list(self._tank_rows(response, tank_ids, tanks_tree))
+                if response.status != 'ok':
+                    failed = True
+                    continue
+                changes = self.db.total_changes
+                previous = set([tid for tid in known if (known[tid][3] == params['tier']) and (known[tid][1] == params['type'])])
+                removed = previous - tank_ids
+                if not names_only:
+                    tanks = [tank for tank, _ in entries if known.get(tank[0]) != tank]
+                    self.sql.executemany(''' INSERT OR REPLACE INTO tanks
+                                             (server, tank_id, type, nation, tier, tag, is_premium, is_gift,
+                                              is_wheeled, hp, price_xp, price_credit, price_gold,
+                                              elite_equipment_xp, elite_equipment_cost, elite_tanks_xp)
+                                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ''',
+                                         [(self.tld, ) + tank for tank in tanks])
+                    self.sql.executemany(''' DELETE FROM tanks
+                                             WHERE server  = ?
+                                               AND tank_id = ? ''',
+                                         [(self.tld, tid) for tid in sorted(removed)])
+                    links = set([link for link in known_tree if link[0] in previous or link[0] in tank_ids])
+                    self.sql.executemany(''' INSERT INTO tanks_tree
+                                             (server, tank_id, next_tank_id)
+                                             VALUES (?, ?, ?) ''',
+                                         [(self.tld, ) + link for link in sorted(tanks_tree - known_tree)])
+                    self.sql.executemany(''' DELETE FROM tanks_tree
+                                             WHERE server       = ?
+                                               AND tank_id      = ?
+                                               AND next_tank_id = ? ''',
+                                         [(self.tld, ) + link for link in sorted(links - tanks_tree)])
+                    for tank in tanks:
+                        known[tank[0]] = tank
+                    for tid in removed:
+                        del known[tid]
+                    known_tree = (known_tree - links) | tanks_tree
+                names = [name for _, name in entries if known_names.get(name[0]) != name]
+                self.sql.executemany(''' INSERT OR REPLACE INTO tanks_names
+                                         (server, language, tank_id, name, url, description)
+                                         VALUES (?, ?, ?, ?, ?, '') ''',
+                                     [(self.tld, self.language) + name for name in names])
+                self.sql.executemany(''' DELETE FROM tanks_names
+                                         WHERE server   = ?
+                                           AND language = ?
+                                           AND tank_id  = ? ''',
+                                     [(self.tld, self.language, tid) for tid in sorted(removed) if tid in known_names])
+                for name in names:
+                    known_names[name[0]] = name
+                for tid in removed:
+                    known_names.pop(tid, None)
+                changed = changed or (self.db.total_changes != changes)
+                if resumable:
+                    self.set_checkpoint(task, version, '%(tier)d/%(type)s' % params)
+                self.db.commit()
+        except BaseException:
+            # The batches not committed yet are left for the next run
+            self.db.rollback()
+            raise
+
+        # The version is only saved once all the batches succeeded, else the next run resumes from the checkpoints
+        if not failed:
+            self.sql.execute(''' DELETE FROM tanks_names
+                                 WHERE server = ?
+                                   AND tank_id NOT IN (SELECT tank_id
+                                                       FROM tanks
+                                                       WHERE server = ?) ''',
+                             (self.tld, self.tld))
+            self.sql.execute(''' DELETE FROM checkpoints
+                                 WHERE task = ? ''',
+                             (task, ))
+            if resumable:
+                if not names_only:
+                    self.set_setting('tankopedia_version/%s' % self.tld, version)
+                self.set_setting('tankopedia_version/%s/%s' % (self.tld, self.language), version)
+        if changed and not names_only:
+            self._rebuild_summary()
         self.db.commit()
-        return True
+        self.skeletons.clear()
+        self.graphs.clear()
+        return not failed
+
+    def _rebuild_summary(self):
+        # The lines of the players depend on the tankopedia, so they are computed again when it changes
+        self.sql.execute(''' DELETE FROM players_summary
+                             WHERE server = ? ''',
+                         (self.tld, ))
+        self.sql.execute(''' INSERT INTO players_summary
+                             SELECT a.server, a.account_id, b.nation, b.type, COUNT(*), MAX(b.tier), SUM(a.battles), SUM(a.wins)
+                             FROM players_tanks AS a
+                                 INNER JOIN tanks AS b
+                                     ON  b.server  = a.server
+                                     AND b.tank_id = a.tank_id
+                             WHERE a.server = ?
+                             GROUP BY a.account_id, b.nation, b.type ''',
+                         (self.tld, ))
+
+    def _tank_rows(self, response, tank_ids, tanks_tree):
+        # Pairs of rows (stats, names) of the tanks of a response, the identifiers and the links being collected on the way
+        for _, data in response:
+
+            # Tank main properties
+            entry = {'tank_id': _field(data, 'tank_id', 0),
+                     'type': _field(data, 'type'),
+                     'nation': _field(data, 'nation'),
+                     'tier': _field(data, 'tier', 0),
+                     'tag': _field(data, 'tag'),
+                     'is_premium': _bool(_field(data, 'is_premium')),
+                     'is_gift': _bool(_field(data, 'is_gift')),
+                     'is_wheeled': _bool(_field(data, 'is_wheeled')),
+                     'hp': _field(data, 'default_profile/hp'),
+                     'price_xp': 0,
+                     'price_credit': _field(data, 'price_credit', 0),
+                     'price_gold': _field(data, 'price_gold', 0),
+                     'elite_equipment_xp': 0,
+                     'elite_equipment_cost': 0,
+                     'elite_tanks_xp': 0}
+
+            # Parent tank to deduct tank XP (inaccurate for SU-152 that has 2 parents)
+            subdata = _field(data, 'prices_xp')
+            for nid in subdata:
+                entry['price_xp'] = subdata[nid]
+                break
+
+            # Modules XP & cost
+            subdata = _field(data, 'modules_tree')
+            for nid in subdata:
+                if not _bool(_field(subdata[nid], 'is_default')):
+                    entry['elite_equipment_xp'] += _field(subdata[nid], 'price_xp', 0)
+                    entry['elite_equipment_cost'] += _field(subdata[nid], 'price_credit', 0)
+
+            # Tanks tree
+            subdata = _field(data, 'next_tanks')
+            for nid in subdata:
+                tanks_tree.add((entry['tank_id'], _int(nid)))
+                entry['elite_tanks_xp'] += subdata[nid]
+
+            # Localized strings
+            name = (entry['tank_id'],
+                    _field(data, 'name'),
+                    'https://worldoftanks.%s/%s/tankopedia/%d-%s/' % (self.tld, self.language, entry['tank_id'], entry['tag']))
+            tank_ids.add(entry['tank_id'])
+            yield _o2t(entry), name
 
     def cache_player(self, refresh=False):
+        return self.cache_players([self.account_id], refresh=refresh)
+
+    @_phase('cache_players')
+    def cache_players(self, account_ids, refresh=False):
         # Connect to the database
-        if self.sql.execute(''' SELECT 1
-                                FROM players_tanks
-                                WHERE server     = ?
-                                    AND account_id = ?
-                                LIMIT 1 ''',
-                            (self.tld, self.account_id)).fetchone() is not None:
-            if refresh:
-                self.sql.execute(''' DELETE FROM players_tanks
-                                     WHERE server     = ?
-                                       AND account_id = ? ''',
-                                 (self.tld, self.account_id))
+        candidates = []
+        for account_id in account_ids:
+            if refresh or self.sql.execute(''' SELECT 1
+                                               FROM players_tanks
+                                               WHERE server     = ?
+                                                 AND account_id = ?
+                                               LIMIT 1 ''',
+                                           (self.tld, account_id)).fetchone() is None:
+                candidates.append(account_id)
+
+        # The batches saved by a recent interrupted refresh of the same roster are skipped, the run keeping its start time as version
+        # Without refresh, the saved players are not candidates anymore, and a single batch has nothing to resume
+        task = 'account/tanks/%s/%s' % (self.tld, hashlib.sha256(','.join([str(k) for k in sorted(candidates)]).encode('utf-8')).hexdigest()[:40])
+        version = str(int(time()))
+        resumable = refresh and (len(candidates) > API_BATCH)
+        if resumable:
+            self.sql.execute(''' DELETE FROM checkpoints
+                                 WHERE task LIKE 'account/tanks/%'
+                                   AND CAST(version AS INTEGER) < ? ''',
+                             (int(time()) - PLAYERS_RESUME, ))
+            row = self.sql.execute(''' SELECT version
+                                       FROM checkpoints
+                                       WHERE task = ?
+                                       LIMIT 1 ''',
+                                   (task, )).fetchone()
+            if row is not None:
+                version = row['version']
+            done = set()
+            for batch in self.get_checkpoints(task, version):
+                done.update(batch.split(','))
+            candidates = [k for k in candidates if str(k) not in done]
+            self.db.commit()
+        if len(candidates) == 0:
+            return True
+
+        # Check the last activity of the players by batches of accounts
+        batches = []
+        for chunk in _chunks(candidates, API_BATCH):
+            batches.append({'application_id': APP_ID,
+                            'account_id': ','.join([str(k) for k in chunk]),
+                            'fields': 'account_id,nickname,last_battle_time,updated_at'})
+        # The players of a failed batch are left for the next run
+        activity = {}
+        failed = False
+        for response in self.api.stream_many(self.tld, 'account/info', batches):
+            found = {}
+            for account_id, data in response:
+                if data is not None:
+                    found[_int(account_id)] = (_field(data, 'nickname'),
+                                               _field(data, 'last_battle_time', 0),
+                                               _field(data, 'updated_at', 0))
+            if response.status == 'ok':
+                activity.update(found)
             else:
-                return True
-        print('Fetching the tanks of the player...')
-
-        # Call the API
-        params = {'application_id': APP_ID,
-                  'account_id': self.account_id,
-                  'language': self.language}
-        url = 'https://api.worldoftanks.%s/wot/account/tanks/?%s' % (self.tld, urlencode(params))
-        query = urlopen(Request(url, None, method='GET'))
-        if query.status == 200:
-            data = query.read().decode('utf-8')
-            data = json.loads(data)
-            if _field(data, 'status') != 'ok':
-                return False
+                failed = True
+
+        # Skip the players who did not play since the last run
+        # The tanks of a new player form a baseline at the time 0, as the date of their unlocking is unknown
+        active = []
+        first = set()
+        for account_id in candidates:
+            if account_id not in activity:
+                continue
+            row = self.sql.execute(''' SELECT a.last_battle_time, b.tank_id
+                                       FROM players AS a
+                                           LEFT OUTER JOIN players_tanks AS b
+                                               ON  b.server     = a.server
+                                               AND b.account_id = a.account_id
+                                       WHERE a.server     = ?
+                                         AND a.account_id = ?
+                                       LIMIT 1 ''',
+                                   (self.tld, account_id)).fetchone()
+            if (row is None) or (row['tank_id'] is None) or (row['last_battle_time'] != activity[account_id][1]):
+                active.append(account_id)
+                if (row is None) or (row['tank_id'] is None):
+                    first.add(account_id)
+        if len(active) > 0:
+            print('Fetching the tanks of %d player(s)...' % len(active))
+
+        # Call the API by batches of accounts
+        chunks = list(_chunks(active, API_BATCH))
+        batches = []
+        for chunk in chunks:
+            batches.append({'application_id': APP_ID,
+                            'account_id': ','.join([str(k) for k in chunk]),
+                            'fields': 'tank_id,statistics.battles,statistics.wins,mark_of_mastery'})
+
+        # Lines of the tanks for the summary of the players
+        lines = {}
+        self.sql.execute(''' SELECT tank_id, nation, type, tier
+                             FROM tanks
+                             WHERE server = ? ''',
+                         (self.tld, ))
+        for row in self.sql.fetchall():
+            lines[row['tank_id']] = (row['nation'], row['type'], row['tier'])
 
-            # Analyze each tank
-            for entry in data['data'][str(self.account_id)]:
-                self.sql.execute(''' INSERT INTO players_tanks
-                                     (server, account_id, tank_id, battles, wins, mastery, win_rate)
-                                     VALUES (?, ?, ?, ?, ?, ?, 0) ''',
-                                 (self.tld,
-                                  self.account_id,
-                                  _field(entry, 'tank_id'),
-                                  _field(entry, 'statistics/battles'),
-                                  _field(entry, 'statistics/wins'),
-                                  _field(entry, 'mark_of_mastery')))
-        self.sql.execute(''' UPDATE players_tanks
-                             SET win_rate = ROUND(1000.0 * wins / battles) / 10.
-                             WHERE server     = ?
-                               AND account_id = ? ''',
-                         (self.tld, self.account_id))
+        # Save to database batch after batch, each one with the last activity of its players
+        # An interrupted or failed run is then resumed with the players not saved yet
+        # The history only receives the tanks whose counters changed, dated by the last battle of the player
+        saved = monotonic()
+        try:
+            for chunk, response in zip(chunks, self.api.stream_many(self.tld, 'account/tanks', batches)):
+                changes = []
+                rows = list(self._player_rows(response, changes))
+                if response.status != 'ok':
+                    failed = True
+                    continue
+                self.sql.executemany(''' INSERT INTO players_tanks
+                                         (server, account_id, tank_id, battles, wins, mastery, win_rate)
+                                         VALUES (?1, ?2, ?3, ?4, ?5, ?6, IFNULL(ROUND(1000.0 * ?5 / ?4) / 10., 0))
+                                         ON CONFLICT (tank_id, account_id, server) DO UPDATE
+                                         SET battles  = excluded.battles,
+                                             wins     = excluded.wins,
+                                             mastery  = excluded.mastery,
+                                             win_rate = excluded.win_rate ''', rows)
+                self.sql.executemany(''' INSERT OR REPLACE INTO players_history
+                                         (server, account_id, tank_id, battles, wins, mastery, time)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?) ''',
+                                     [row + (0 if row[1] in first else activity[row[1]][1] or int(time()), ) for row in rows])
+                self._update_summary(changes, lines)
+                self.sql.executemany(''' INSERT INTO players
+                                         (server, account_id, name, last_battle_time, updated_at)
+                                         VALUES (?, ?, ?, ?, ?)
+                                         ON CONFLICT (account_id, server) DO UPDATE
+                                         SET last_battle_time = excluded.last_battle_time,
+                                             updated_at       = excluded.updated_at ''',
+                                     [(self.tld, account_id) + activity[account_id] for account_id in chunk])
+                if resumable:
+                    self.set_checkpoint(task, version, ','.join([str(k) for k in chunk]))
+                if monotonic() - saved >= SAVE_INTERVAL:
+                    self.db.commit()
+                    saved = monotonic()
+        except BaseException:
+            # The batches not committed yet are left for the next run
+            self.db.rollback()
+            raise
+        if resumable and not failed:
+            self.sql.execute(''' DELETE FROM checkpoints
+                                 WHERE task = ? ''',
+                             (task, ))
         self.db.commit()
-        return True
+        return not failed
+
+    def _update_summary(self, changes, lines):
+        # The summaries receive the differences grouped per tank and per line of each player
+        # A few grouped statements per batch of players cost much less than a trigger per row
+        tanks = {}
+        players = {}
+        for account_id, tank_id, count, battles, wins in changes:
+            total = tanks.setdefault(tank_id, [0, 0, 0])
+            total[0] += count
+            total[1] += battles
+            total[2] += wins
+            if tank_id in lines:
+                nation, type, tier = lines[tank_id]
+                total = players.setdefault((account_id, nation, type), [0, 0, 0, 0])
+                total[0] += count
+                total[1] = max(total[1], tier if count > 0 else 0)
+                total[2] += battles
+                total[3] += wins
+        self.sql.executemany(''' INSERT INTO tanks_summary
+                                 (server, tank_id, players, battles, wins)
+                                 VALUES (?, ?, ?, ?, ?)
+                                 ON CONFLICT (tank_id, server) DO UPDATE
+                                 SET players = players + excluded.players,
+                                     battles = battles + excluded.battles,
+                                     wins    = wins    + excluded.wins ''',
+                             [(self.tld, k) + tuple(tanks[k]) for k in sorted(tanks)])
+        self.sql.executemany(''' INSERT INTO players_summary
+                                 (server, account_id, nation, type, tanks, max_tier, battles, wins)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT (server, account_id, nation, type) DO UPDATE
+                                 SET tanks    = tanks + excluded.tanks,
+                                     max_tier = MAX(max_tier, excluded.max_tier),
+                                     battles  = battles + excluded.battles,
+                                     wins     = wins    + excluded.wins ''',
+                             [(self.tld, ) + k + tuple(players[k]) for k in sorted(players)])
+
+    def _player_rows(self, response, changes):
+        # Rows of the tanks whose number of battles changed, with a separate cursor for the current values
+        # The differences of players, battles and wins are added to "changes"
+        for account_id, data in response:
+            known = {}
+            for row in self.db.execute(''' SELECT tank_id, battles, wins
+                                           FROM players_tanks
+                                           WHERE server     = ?
+                                             AND account_id = ? ''',
+                                       (self.tld, _int(account_id))):
+                known[row['tank_id']] = (row['battles'], row['wins'])
+            for entry in data or []:
+                tank_id = _field(entry, 'tank_id', 0)
+                battles = _field(entry, 'statistics/battles', 0)
+                wins = _field(entry, 'statistics/wins', 0)
+                previous = known.get(tank_id)
+                if (previous is None) or (previous[0] != battles):
+                    changes.append((_int(account_id),
+                                    tank_id,
+                                    1 if previous is None else 0,
+                                    battles - (previous[0] if previous is not None else 0),
+                                    wins - (previous[1] if previous is not None else 0)))
+                    yield (self.tld,
+                           _int(account_id),
+                           tank_id,
+                           battles,
+                           wins,
+                           _field(entry, 'mark_of_mastery', 0))
+
+    def get_skeleton(self, special=True):
+        # The skeleton only depends on the tankopedia, so it is shared by all the players
+        # One skeleton is kept per realm and language, for the current version only
+        key = (self.tld, self.language, special, self.get_version(), self.get_version(self.language))
+        if key not in self.skeletons:
+            STATS.count('skeleton_misses')
+            for old in [k for k in self.skeletons if k[:3] == key[:3]]:
+                del self.skeletons[old]
+            self.skeletons[key] = self._build_skeleton(special)
+        else:
+            STATS.count('skeleton_hits')
+        return self.skeletons[key]
+
+    def get_graph(self):
+        # The index of the tech tree is built once per version of the tankopedia of the realm
+        key = (self.tld, self.get_version())
+        if key not in self.graphs:
+            for old in [k for k in self.graphs if k[0] == key[0]]:
+                del self.graphs[old]
+            self.graphs[key] = self._build_graph()
+        return self.graphs[key]
+
+    @_phase('build_graph')
+    def _build_graph(self):
+        tanks = self.sql.execute(''' SELECT tank_id, type, nation, tier, is_premium, is_gift,
+                                            price_xp, price_credit, price_gold
+                                     FROM tanks
+                                     WHERE server = ? ''',
+                                 (self.tld, )).fetchall()
+        links = self.sql.execute(''' SELECT tank_id, next_tank_id
+                                     FROM tanks_tree
+                                     WHERE server = ? ''',
+                                 (self.tld, )).fetchall()
+        return TechGraph(tanks, [tuple(row) for row in links])
 
-    def generate_graphviz(self, filename, min_played=0, special=True, mastery=True, tier_helper=True):
+    def get_remaining(self, account_ids, targets=None):
+        # Remaining costs for a whole roster, whose tanks are read with a few queries
+        graph = self.get_graph()
+        owned = dict([(account_id, set()) for account_id in account_ids])
+        for chunk in _chunks(list(owned), 500):     # Below the limit of variables of SQLite
+            self.sql.execute(''' SELECT account_id, tank_id
+                                 FROM players_tanks
+                                 WHERE server = ?
+                                   AND account_id IN (%s) ''' % ','.join(['?'] * len(chunk)),
+                             [self.tld] + chunk)
+            for row in self.sql.fetchall():
+                owned[row['account_id']].add(row['tank_id'])
+        return dict([(account_id, graph.remaining(owned[account_id], targets)) for account_id in owned])
+
+    def analytics(self, report, min_played=0):
+        # Aggregates of all the players of the realm, read from the summary tables maintained by cache_players
+        if report == 'lines':
+            # Lines climbed by the players, ranked per nation by the average of the highest tier reached
+            self.sql.execute(''' SELECT nation, type, players, avg_max_tier, top_players,
+                                        RANK() OVER (PARTITION BY nation ORDER BY avg_max_tier DESC) AS rank
+                                 FROM (SELECT nation, type, COUNT(*) AS players,
+                                              ROUND(AVG(max_tier), 2) AS avg_max_tier,
+                                              SUM(max_tier = ?) AS top_players
+                                       FROM players_summary
+                                       WHERE server = ?
+                                       GROUP BY nation, type)
+                                 ORDER BY nation, rank, type ''',
+                             (MAX_TIER, self.tld))
+        elif report == 'tiers':
+            # Share of the tanks owned per nation and tier
+            players = self.sql.execute(''' SELECT COUNT(DISTINCT account_id)
+                                           FROM players_summary
+                                           WHERE server = ? ''',
+                                       (self.tld, )).fetchone()[0]
+            self.sql.execute(''' SELECT a.nation, a.tier, COUNT(*) AS tanks,
+                                        SUM(IFNULL(b.players, 0)) AS owned,
+                                        ROUND(100.0 * SUM(IFNULL(b.players, 0)) / (COUNT(*) * ?), 1) AS share
+                                 FROM tanks AS a
+                                     LEFT OUTER JOIN tanks_summary AS b
+                                         ON  b.server  = a.server
+                                         AND b.tank_id = a.tank_id
+                                 WHERE a.server = ?
+                                 GROUP BY a.nation, a.tier
+                                 ORDER BY a.nation, a.tier ''',
+                             (max(1, players), self.tld))
+        elif report == 'tanks':
+            # Win rate per tank, ranked per tier
+            self.sql.execute(''' SELECT a.tank_id, IFNULL(c.name, '') AS name, a.nation, a.tier, a.type,
+                                        b.players, b.battles, ROUND(100.0 * b.wins / b.battles, 1) AS win_rate,
+                                        RANK() OVER (PARTITION BY a.tier ORDER BY 1.0 * b.wins / b.battles DESC) AS rank
+                                 FROM tanks_summary AS b
+                                     INNER JOIN tanks AS a
+                                         ON  a.server  = b.server
+                                         AND a.tank_id = b.tank_id
+                                     LEFT OUTER JOIN tanks_names AS c
+                                         ON  c.server   = b.server
+                                         AND c.language = ?
+                                         AND c.tank_id  = b.tank_id
+                                 WHERE b.server   = ?
+                                   AND b.battles >= ?
+                                   AND b.battles  > 0
+                                 ORDER BY a.tier, rank, a.tank_id ''',
+                             (self.language, self.tld, min_played))
+        else:
+            return None
+        return [column[0] for column in self.sql.description], [tuple(row) for row in self.sql.fetchall()]
+
+    @_phase('build_skeleton')
+    def _build_skeleton(self, special):
         # https://graphviz.org/doc/info/lang.html
 
         # Initialize
         roman = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']  # ['&#x%x;' % i for i in range(0x2160, 0x216A)]
+        glyphs = {'AT-SPG': '&#x25BC;',
+                  'heavyTank': '&#x25CF;',
+                  'lightTank': '&#x2BC1;',
+                  'mediumTank': '&#x25C8;',
+                  'SPG': '&#x25FC;'}
 
-        def _attr2str(obj):
-            return ';'.join([' %s = "%s"' % (k, obj[k].replace('"', '\\"')) for k in obj])
-
-        # List of the nations played by the user
-        self.sql.execute(''' SELECT DISTINCT b.nation
-                             FROM players_tanks AS a
-                                 INNER JOIN tanks AS b
-                                     ON b.tank_id = a.tank_id
-                             WHERE a.server      = ?
-                               AND a.account_id  = ?
-                               AND a.battles    >= ?
-                             ORDER BY nation ''',
-                         (self.tld, self.account_id, min_played))
-        nations = [row['nation'] for row in self.sql.fetchall()]
-        if len(nations) == 0:
-            return False
-        print('Generating the picture...')
-
-        # List of the tanks owned by the player
-        owned_tanks = {}
-        self.sql.execute(''' SELECT tank_id, battles, wins, mastery, win_rate
-                             FROM players_tanks
-                             WHERE server     = ?
-                               AND account_id = ?
-                             ORDER BY tank_id ''',
-                         (self.tld, self.account_id))
-        for row in self.sql.fetchall():
-            owned_tanks['n%d' % row['tank_id']] = row
+        def _esc(value):
+            return value.replace('"', '\\"')
 
-        # List of all the tanks
-        tanks = {}
-        self.sql.execute(''' SELECT tank_id, type, nation, tier, name, is_premium,
-                                    price_xp, price_credit, price_gold, elite_equipment_xp,
-                                    elite_equipment_cost, elite_tanks_xp, description, url
-                             FROM tanks
-                             ORDER BY nation, tier, type ''')
-        for row in self.sql.fetchall():
-            row['type'] = {'AT-SPG': '&#x25BC;',
-                           'heavyTank': '&#x25CF;',
-                           'lightTank': '&#x2BC1;',
-                           'mediumTank': '&#x25C8;',
-                           'SPG': '&#x25FC;'}[row['type']]
-            tanks['n%d' % row['tank_id']] = row
-
-        # Excluded tanks
+        # Tanks without predecessor, hidden unless they are owned by the player
+        orphans = set()
         if special:
             self.sql.execute(''' SELECT a.tank_id
                                  FROM tanks AS a
-                                     LEFT OUTER JOIN tanks_tree AS b         -- No predecessor
-                                         ON b.next_tank_id = a.tank_id
-                                     LEFT OUTER JOIN players_tanks AS c      -- Not owned by the player
-                                         ON  c.server     = ?
-                                         AND c.account_id = ?
-                                         AND c.tank_id    = a.tank_id
-                                 WHERE a.tier > 1
-                                 AND b.tank_id IS NULL
-                                 AND c.tank_id IS NULL ''',
+                                     LEFT OUTER JOIN tanks_tree AS b
+                                         ON  b.next_tank_id = a.tank_id
+                                         AND b.server       = a.server
+                                 WHERE a.server = ?
+                                   AND a.tier > 1
+                                   AND b.tank_id IS NULL ''',
+                             (self.tld, ))
+            orphans = set([row['tank_id'] for row in self.sql.fetchall()])
+
+        # Compiled nodes grouped by nation
+        skeleton = {'nations': {}, 'nation_of': {}, 'edges': []}
+        self.sql.execute(''' SELECT a.tank_id, a.type, a.nation, a.tier, b.name, a.is_premium, a.is_gift,
+                                    a.price_xp, a.price_credit, a.price_gold, a.elite_equipment_xp,
+                                    a.elite_equipment_cost, a.elite_tanks_xp, b.url
+                             FROM tanks AS a
+                                 INNER JOIN tanks_names AS b
+                                     ON  b.server   = a.server
+                                     AND b.language = ?
+                                     AND b.tank_id  = a.tank_id
+                             WHERE a.server = ?
+                             ORDER BY a.nation, a.tier, a.type, a.tank_id ''',
+                         (self.language, self.tld))
+        for t in self.sql.fetchall():
+            skeleton['nation_of'][t['tank_id']] = t['nation']
+            if not special and (t['is_premium'] or t['is_gift'] or (t['price_gold'] > 0) or (t['price_xp'] == 0 and t['tier'] > 1)):
+                continue
+            tid = 'n%d' % t['tank_id']
+            label = '%s %s %s%s' % (roman[t['tier'] - 1],
+                                    glyphs[t['type']],
+                                    t['name'],
+                                    ' &#x2605;' if t['is_premium'] else '')
+            tooltip = 'Tank %s\\n' % tid[1:]
+            if t['price_gold'] + t['price_credit'] == 0:
+                tooltip += 'With obligations'
+            elif t['price_gold'] > 0:
+                tooltip += 'Gold %d' % t['price_gold']
+            else:
+                tooltip += 'Cost = %d (base) + %d (equipments)' % (t['price_credit'], t['elite_equipment_cost'])
+            if t['price_xp'] + t['elite_equipment_xp'] + t['elite_tanks_xp'] > 0:
+                tooltip += '\\nXP = %d (base) + %d (equipments) + %d (tanks)' % (t['price_xp'],
+                                                                                 t['elite_equipment_xp'],
+                                                                                 t['elite_tanks_xp'])
+            node = {'tank_id': t['tank_id'],
+                    'tier': t['tier'],
+                    'label': label,
+                    'tooltip': tooltip,
+                    'url': t['url'],
+                    'orphan': t['tank_id'] in orphans,
+                    'head': '\n%s [ label = "%s' % (tid, _esc(label)),
+                    'middle': '"; tooltip = "%s"; fontname = "%s"; color = "' % (_esc(tooltip), _esc(UNICODE_FONT)),
+                    'after': '"; penwidth = "2.5"; shape = "box"',
+                    'tail': '; URL = "%s"];' % _esc(t['url'])}
+            skeleton['nations'].setdefault(t['nation'], []).append(node)
+
+        # Compiled edges
+        self.sql.execute(''' SELECT a.tank_id, a.next_tank_id, b.nation
+                             FROM tanks_tree AS a
+                                 INNER JOIN tanks AS b
+                                     ON  b.server  = a.server
+                                     AND b.tank_id = a.tank_id
+                             WHERE a.server = ?
+                             ORDER BY a.tank_id, a.next_tank_id ''',
+                         (self.tld, ))
+        for row in self.sql.fetchall():
+            skeleton['edges'].append((row['nation'], row['tank_id'], row['next_tank_id'], '\nn%d -> n%d;' % (row['tank_id'], row['next_tank_id'])))
+        return skeleton
+
+    def get_history(self, as_of=None):
+        # Tanks of the player at a given time, rebuilt from the last change of each tank
+        if as_of is None:
+            self.sql.execute(''' SELECT tank_id, battles, wins, mastery, win_rate
+                                 FROM players_tanks
+                                 WHERE server     = ?
+                                   AND account_id = ?
+                                 ORDER BY tank_id ''',
                              (self.tld, self.account_id))
         else:
-            self.sql.execute(''' SELECT tank_id
-                                 FROM tanks
-                                 WHERE is_premium = 'X'
-                                    OR is_gift    = 'X'
-                                    OR price_gold > 0
-                                    OR (price_xp == 0 AND tier > 1) ''')
-        excluded_tanks = ['n%d' % row['tank_id'] for row in self.sql.fetchall()]
+            self.sql.execute(''' SELECT tank_id, MAX(time) AS time, battles, wins, mastery,
+                                        IFNULL(ROUND(1000.0 * wins / battles) / 10., 0) AS win_rate
+                                 FROM players_history
+                                 WHERE server     = ?
+                                   AND account_id = ?
+                                   AND time      <= ?
+                                 GROUP BY tank_id
+                                 ORDER BY tank_id ''',
+                             (self.tld, self.account_id, as_of))
+        owned_tanks = {}
+        for row in self.sql.fetchall():
+            owned_tanks[row['tank_id']] = row
+        return owned_tanks
+
+    def get_progress(self, since, until=None):
+        # Battles and wins per tank between two times, the new tanks having no previous value
+        before = self.get_history(since)
+        after = self.get_history(until)
+        progress = {}
+        for tank_id in after:
+            previous = before.get(tank_id)
+            battles = after[tank_id]['battles'] - (previous['battles'] if previous is not None else 0)
+            if battles > 0 or previous is None:
+                progress[tank_id] = {'battles': battles,
+                                     'wins': after[tank_id]['wins'] - (previous['wins'] if previous is not None else 0),
+                                     'new': previous is None}
+        return progress
+
+    def get_view(self, min_played=0, special=True, mastery=True, as_of=None, since=None, remaining=False):
+        # Overlay the statistics of the player on the skeleton of the tech tree
+        # The view is the one at the time "as_of", and the tanks unlocked since the time "since" are highlighted
+        # The tanks not researched yet show the XP and credits still needed when "remaining" is set
+        skeleton = self.get_skeleton(special)
+
+        # List of the tanks owned by the player
+        owned_tanks = self.get_history(as_of)
+        progress = self.get_progress(since, as_of) if since is not None else {}
+        costs = self.get_graph().remaining(set(owned_tanks)) if remaining else {}
+
+        # List of the nations played by the user
+        nations = set()
+        for tank_id in owned_tanks:
+            if (owned_tanks[tank_id]['battles'] >= min_played) and (tank_id in skeleton['nation_of']):
+                nations.add(skeleton['nation_of'][tank_id])
+        if len(nations) == 0:
+            return None
+
+        # Visible tanks and their attributes
+        view = {'nations': [], 'edges': [], 'battles': 0, 'wins': 0, 'period': ''}
+        for nat in sorted(nations):
+            items = []
+            for node in skeleton['nations'].get(nat, []):
+                otid = owned_tanks.get(node['tank_id'])
+                if otid is None and node['orphan']:
+                    continue
+                item = {'node': node, 'stats': '', 'color': 'red', 'fillcolor': ''}
+                if otid is not None:
+                    item['stats'] = '\\n%d / %d = %.1f %%' % (otid['wins'], otid['battles'], otid['win_rate'])
+                    item['color'] = 'blue' if node['tank_id'] in progress and progress[node['tank_id']]['new'] else 'green'
+                    view['battles'] += otid['battles']
+                    view['wins'] += otid['wins']
+                elif costs.get(node['tank_id']) is not None:
+                    item['stats'] = '\\n%d XP, %d credits left' % costs[node['tank_id']]
+                if mastery:
+                    item['fillcolor'] = ['', '#CAA236', '#E0E0E0', '#FFFF00', 'green'][_int(otid['mastery'])] if otid is not None else '#FFE1E1'
+                items.append(item)
+            view['nations'].append((nat, items))
+        for edge in skeleton['edges']:
+            if edge[0] in nations:
+                view['edges'].append(edge)
+
+        # Period of the view
+        if as_of is not None:
+            view['period'] += ' as of %s' % strftime('%Y-%m-%d', localtime(as_of))
+        if since is not None:
+            view['period'] += ', %d new tanks and %d battles since %s' % (len([k for k in progress if progress[k]['new']]),
+                                                                         sum([progress[k]['battles'] for k in progress]),
+                                                                         strftime('%Y-%m-%d', localtime(since)))
+        return view
+
+    @_phase('build_graphviz')
+    def build_graphviz(self, min_played=0, special=True, mastery=True, tier_helper=True, as_of=None, since=None, remaining=False):
+        # https://graphviz.org/doc/info/lang.html
+        view = self.get_view(min_played=min_played, special=special, mastery=mastery, as_of=as_of, since=since, remaining=remaining)
+        if view is None:
+            return None
+        print('Generating the picture...')
 
         # Build the graph
-        counter = {'battles': 0, 'wins': 0}
-        buffer = 'digraph wot {'
+        buffer = ['digraph wot {']
         # Bar of the tiers
         if tier_helper:
-            buffer += '\n{ node [shape = plaintext; fontsize = 16]; I -> II -> III -> IV -> V -> VI -> VII -> VIII -> IX -> X }'
+            buffer.append('\n{ node [shape = plaintext; fontsize = 16]; I -> II -> III -> IV -> V -> VI -> VII -> VIII -> IX -> X }')
         # Block of nations
-        for nat in nations:
-            buffer += '\nsubgraph cluster_%s {' % nat
-            buffer += 'label = "%s";' % nat.upper()
+        for nat, items in view['nations']:
+            buffer.append('\nsubgraph cluster_%s {' % nat)
+            buffer.append('label = "%s";' % nat.upper())
             rank_lines = [[] for i in range(MAX_TIER + 1)]
             # Tanks of the nation
-            for tid in tanks:
-                if tid in excluded_tanks:
-                    continue
-                t = tanks[tid]
-                if t['nation'] == nat:
-                    attr = {}
-                    attr['label'] = '%s %s %s%s' % (roman[t['tier'] - 1],
-                                                    t['type'],
-                                                    t['name'],
-                                                    ' &#x2605;' if t['is_premium'] else '')
-                    if tid in owned_tanks:
-                        otid = owned_tanks[tid]
-                        attr['label'] += '\\n%d / %d = %.1f %%' % (otid['wins'], otid['battles'], otid['win_rate'])
-                        counter['battles'] += otid['battles']
-                        counter['wins'] += otid['wins']
-                    attr['tooltip'] = 'Tank %s\\n' % tid[1:]
-                    if t['price_gold'] + t['price_credit'] == 0:
-                        attr['tooltip'] += 'With obligations'
-                    elif t['price_gold'] > 0:
-                        attr['tooltip'] += 'Gold %d' % t['price_gold']
-                    else:
-                        attr['tooltip'] += 'Cost = %d (base) + %d (equipments)' % (t['price_credit'], t['elite_equipment_cost'])
-                    if t['price_xp'] + t['elite_equipment_xp'] + t['elite_tanks_xp'] > 0:
-                        attr['tooltip'] += '\\nXP = %d (base) + %d (equipments) + %d (tanks)' % (t['price_xp'],
-                                                                                                 t['elite_equipment_xp'],
-                                                                                                 t['elite_tanks_xp'])
-                    attr['fontname'] = UNICODE_FONT
-                    attr['color'] = 'green' if tid in owned_tanks else 'red'
-                    attr['penwidth'] = '2.5'
-                    attr['shape'] = 'box'
-                    if mastery:
-                        ranking = ['', '#CAA236', '#E0E0E0', '#FFFF00', 'green'][_int(owned_tanks[tid]['mastery'])] if tid in owned_tanks else '#FFE1E1'
-                        if ranking != '':
-                            attr['style'] = 'filled'
-                            attr['fillcolor'] = ranking
-                    attr['URL'] = t['url']
-                    rank_lines[t['tier']].append(tid)
-                    buffer += '\n%s [%s];' % (tid, _attr2str(attr))
+            for item in items:
+                node = item['node']
+                fill = '' if item['fillcolor'] == '' else '; style = "filled"; fillcolor = "%s"' % item['fillcolor']
+                rank_lines[node['tier']].append('n%d' % node['tank_id'])
+                buffer.append(''.join([node['head'], item['stats'], node['middle'], item['color'], node['after'], fill, node['tail']]))
             # Constrained ranks
             for a in rank_lines:
                 if len(a) > 0:
-                    buffer += '\n{rank = same; %s}' % ('; '.join(a))
-            buffer += '\n}'
+                    buffer.append('\n{rank = same; %s}' % ('; '.join(a)))
+            buffer.append('\n}')
         # Tank tree
-        self.sql.execute(''' SELECT a.tank_id, a.next_tank_id, b.nation
-                             FROM tanks_tree AS a
-                                 INNER JOIN tanks AS b
-                                     ON b.tank_id = a.tank_id
-                             ORDER BY a.tank_id, a.next_tank_id ''')
-        for row in self.sql.fetchall():
-            if row['nation'] in nations:
-                buffer += '\nn%d -> n%d;' % (row['tank_id'], row['next_tank_id'])
+        for edge in view['edges']:
+            buffer.append(edge[3])
         # Title of the graph
-        buffer += '\nlabel = <<B>%s\'s tech tree in World of Tanks</B><BR/>%d wins in %d battles (%.1f%%)>;' % \
-                  (self.player,
-                   counter['wins'],
-                   counter['battles'],
-                   100.0 * counter['wins'] / counter['battles'])
+        buffer.append('\nlabel = <<B>%s\'s tech tree in World of Tanks</B><BR/>%d wins in %d battles (%.1f%%)%s>;' %
+                      (self.player,
+                       view['wins'],
+                       view['battles'],
+                       100.0 * view['wins'] / max(1, view['battles']),
+                       view['period']))
         # Closure
-        buffer += '\n}'
+        buffer.append('\n}')
+        return ''.join(buffer)
+
+    def generate_graphviz(self, filename, min_played=0, special=True, mastery=True, tier_helper=True, as_of=None, since=None, remaining=False):
+        buffer = self.build_graphviz(min_played=min_played, special=special, mastery=mastery, tier_helper=tier_helper, as_of=as_of, since=since, remaining=remaining)
+        if buffer is None:
+            return False
 
         # Save to output
         if filename in [None, '', '.', '..']:
@@ -457,25 +1595,496 @@ class WotTree():
                 return False
         return True
 
+    def layout(self, view, tier_helper=True):
+        # The tech tree has one row per tier and one block per nation, so the nodes are placed directly
+        parents = {}
+        for edge in view['edges']:
+            parents.setdefault(edge[2], []).append(edge[1])
+        positions = {}
+        clusters = []
+        x = SVG_MARGIN + (SVG_TIER_WIDTH if tier_helper else 0)
+        for nat, items in view['nations']:
+            # Rows of the nation
+            rows = [[] for i in range(MAX_TIER + 1)]
+            width = 0
+            for item in items:
+                rows[item['node']['tier']].append(item)
+                for line in (item['node']['label'] + item['stats']).split('\\n'):
+                    width = max(width, _svg_width(line))
+            width += 2 * SVG_NODE_PADDING
+            count = max([len(row) for row in rows])
+            cluster = {'nation': nat,
+                       'x': x,
+                       'y': SVG_MARGIN,
+                       'width': count * (width + SVG_GAP) - SVG_GAP + 2 * SVG_CLUSTER_PADDING,
+                       'height': SVG_CLUSTER_LABEL + (MAX_TIER - 1) * SVG_ROW + SVG_NODE_HEIGHT + SVG_CLUSTER_PADDING}
+
+            # Each row is sorted by the mean position of the parents to limit the crossings
+            slots = {}
+            for tier in range(1, MAX_TIER + 1):
+                keys = []
+                for i, item in enumerate(rows[tier]):
+                    placed = [slots[p] for p in parents.get(item['node']['tank_id'], []) if p in slots]
+                    keys.append((sum(placed) / len(placed) if len(placed) > 0 else i, i))
+                order = sorted(range(len(rows[tier])), key=lambda i: keys[i])
+                offset = (count - len(order)) / 2
+                for rank, i in enumerate(order):
+                    tank_id = rows[tier][i]['node']['tank_id']
+                    slots[tank_id] = offset + rank
+                    positions[tank_id] = (x + SVG_CLUSTER_PADDING + (offset + rank) * (width + SVG_GAP),
+                                          SVG_MARGIN + SVG_CLUSTER_LABEL + (tier - 1) * SVG_ROW,
+                                          width)
+            clusters.append(cluster)
+            x += cluster['width'] + SVG_GAP
+        return {'clusters': clusters,
+                'positions': positions,
+                'width': x - SVG_GAP + SVG_MARGIN,
+                'height': 2 * SVG_MARGIN + SVG_CLUSTER_LABEL + MAX_TIER * SVG_ROW + SVG_TITLE}
+
+    @_phase('build_svg')
+    def build_svg(self, min_played=0, special=True, mastery=True, tier_helper=True, as_of=None, since=None, remaining=False):
+        view = self.get_view(min_played=min_played, special=special, mastery=mastery, as_of=as_of, since=since, remaining=remaining)
+        if view is None:
+            return None
+        print('Generating the picture...')
+        layout = self.layout(view, tier_helper=tier_helper)
+        font = _svg_text(UNICODE_FONT)
+
+        # Header
+        buffer = ['<?xml version="1.0" encoding="UTF-8"?>',
+                  '\n<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="%d" height="%d" viewBox="0 0 %d %d" font-family="%s, sans-serif" font-size="%d">' %
+                  (layout['width'], layout['height'], layout['width'], layout['height'], font, SVG_FONT_SIZE),
+                  '\n<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" orient="auto"><path d="M0,0 L10,5 L0,10 z"/></marker></defs>',
+                  '\n<rect width="100%" height="100%" fill="white"/>']
+        # Bar of the tiers
+        if tier_helper:
+            for tier in range(MAX_TIER):
+                buffer.append('\n<text x="%d" y="%d" font-size="16" text-anchor="middle">%s</text>' %
+                              (SVG_MARGIN + SVG_TIER_WIDTH / 2,
+                               SVG_MARGIN + SVG_CLUSTER_LABEL + tier * SVG_ROW + SVG_NODE_HEIGHT / 2 + 6,
+                               ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X'][tier]))
+        # Block of nations
+        for cluster in layout['clusters']:
+            buffer.append('\n<rect x="%d" y="%d" width="%d" height="%d" fill="none" stroke="black"/>' %
+                          (cluster['x'], cluster['y'], cluster['width'], cluster['height']))
+            buffer.append('\n<text x="%d" y="%d" text-anchor="middle">%s</text>' %
+                          (cluster['x'] + cluster['width'] / 2, cluster['y'] + SVG_CLUSTER_LABEL - 10, _svg_text(cluster['nation'].upper())))
+        # Tank tree
+        positions = layout['positions']
+        for edge in view['edges']:
+            if (edge[1] in positions) and (edge[2] in positions):
+                x1, y1, w1 = positions[edge[1]]
+                x2, y2, w2 = positions[edge[2]]
+                x1, y1, x2 = x1 + w1 / 2, y1 + SVG_NODE_HEIGHT, x2 + w2 / 2
+                buffer.append('\n<path d="M%d,%d C%d,%d %d,%d %d,%d" fill="none" stroke="black" marker-end="url(#arrow)"/>' %
+                              (x1, y1, x1, (y1 + y2) / 2, x2, (y1 + y2) / 2, x2, y2))
+        # Tanks
+        for nat, items in view['nations']:
+            for item in items:
+                node = item['node']
+                x, y, w = positions[node['tank_id']]
+                lines = (node['label'] + item['stats']).split('\\n')
+                buffer.append('\n<a xlink:href="%s"><title>%s</title>' % (_svg_text(node['url']), _svg_text(node['tooltip'].replace('\\n', '\n'))))
+                buffer.append('<rect x="%d" y="%d" width="%d" height="%d" fill="%s" stroke="%s" stroke-width="2.5"/>' %
+                              (x, y, w, SVG_NODE_HEIGHT, item['fillcolor'] or 'white', item['color']))
+                for i, line in enumerate(lines):
+                    buffer.append('<text x="%d" y="%d" text-anchor="middle">%s</text>' %
+                                  (x + w / 2,
+                                   y + SVG_NODE_HEIGHT / 2 + (i - (len(lines) - 1) / 2) * (SVG_FONT_SIZE + 2) + SVG_FONT_SIZE / 3,
+                                   _svg_text(line)))
+                buffer.append('</a>')
+        # Title of the graph
+        buffer.append('\n<text x="%d" y="%d" text-anchor="middle" font-size="14"><tspan font-weight="bold">%s\'s tech tree in World of Tanks</tspan><tspan x="%d" dy="18">%d wins in %d battles (%.1f%%)%s</tspan></text>' %
+                      (layout['width'] / 2,
+                       layout['height'] - SVG_MARGIN - SVG_TITLE + 20,
+                       _svg_text(self.player),
+                       layout['width'] / 2,
+                       view['wins'],
+                       view['battles'],
+                       100.0 * view['wins'] / max(1, view['battles']),
+                       view['period']))
+        # Closure
+        buffer.append('\n</svg>\n')
+        return ''.join(buffer)
+
+    def generate_svg(self, filename, min_played=0, special=True, mastery=True, tier_helper=True, as_of=None, since=None, remaining=False):
+        buffer = self.build_svg(min_played=min_played, special=special, mastery=mastery, tier_helper=tier_helper, as_of=as_of, since=since, remaining=remaining)
+        if buffer is None:
+            return False
+
+        # Save to output
+        if filename in [None, '', '.', '..']:
+            sys.stdout.reconfigure(encoding='utf-8')
+            print(buffer)
+            return True
+        return _render_svg(buffer, filename)
+
+    @_phase('dot')
     def generate_picture(self, filename):
         if filename not in [None, '', '.', '..']:
-            ext = filename.split('.')[-1].strip().lower()
-            if ext in ['png', 'jpg', 'svg', 'ps', 'json']:
-                filename = filename.replace('"', '\\"')
-                return os.system('dot -T%s "%s.gv" -o "%s"' % (ext, filename, filename)) == 0
+            return _render_dot(filename + '.gv', filename)
         return False
 
+    @_phase('render_players')
+    def render_players(self, accounts, filename, renderer='dot', workers=None, min_played=0, special=True, mastery=True, tier_helper=True, as_of=None, since=None, remaining=False):
+        # Previous fingerprints of the pictures
+        manifest_file = os.path.join(os.path.dirname(filename), MANIFEST_FILE)
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
 
-def main():
-    # Check the registration
-    if len(APP_ID) != 32:
-        print('Error: your must register the application first')
+        # Build the sources and skip the pictures whose content did not change
+        result = {'generated': 0, 'unchanged': 0, 'failed': 0}
+        jobs = {}
+        for name in accounts:
+            self.player = name
+            self.account_id = accounts[name]
+            target = filename.replace('{player}', name)
+            ext = target.split('.')[-1].strip().lower()
+            if renderer == 'native':
+                buffer = self.build_svg(min_played=min_played, special=special, mastery=mastery, tier_helper=tier_helper, as_of=as_of, since=since, remaining=remaining)
+            else:
+                buffer = self.build_graphviz(min_played=min_played, special=special, mastery=mastery, tier_helper=tier_helper, as_of=as_of, since=since, remaining=remaining)
+            if buffer is None:
+                result['failed'] += 1
+                continue
+            digest = hashlib.sha256(('%s\n%s\n%s' % (renderer, ext, buffer)).encode('utf-8')).hexdigest()
+            if manifest.get(target) == digest and os.path.exists(target):
+                result['unchanged'] += 1
+                continue
+            if renderer != 'native':
+                try:
+                    with open(target + '.gv', 'w', encoding='utf-8') as f:
+                        f.write(buffer)
+                except OSError:
+                    result['failed'] += 1
+                    continue
+            jobs[target] = (digest, buffer)
+
+        # Render the pictures in parallel
+        STATS.count('pictures_unchanged', result['unchanged'])
+        with STATS.phase('render_pool'), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for target in jobs:
+                if renderer == 'native':
+                    futures[target] = executor.submit(_render_svg, jobs[target][1], target)
+                else:
+                    futures[target] = executor.submit(_render_dot, target + '.gv', target)
+            for target in futures:
+                if futures[target].result():
+                    manifest[target] = jobs[target][0]
+                    result['generated'] += 1
+                else:
+                    manifest.pop(target, None)
+                    result['failed'] += 1
+
+        # Save the fingerprints
+        try:
+            with open(manifest_file, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+        except OSError:
+            pass
+        STATS.count('pictures_generated', result['generated'])
+        STATS.count('pictures_failed', result['failed'])
+        return result
+
+
+class WotService():
+    def __init__(self, wot, cache_size=SERVE_CACHE_SIZE):
+        self.wot = wot
+        self.language = wot.language                # Default language of the pictures
+        self.lock = threading.Lock()                # The tree and its database serve one request at a time
+        self.checks = {}
+        self.player_checks = {}
+        self.keys = {}                              # Key of the last picture of each request
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        self.pending = {}
+
+    def _cache_get(self, key):
+        with self.cache_lock:
+            if key not in self.cache:
+                return None
+            self.cache.move_to_end(key)
+            return self.cache[key][1]
+
+    def _cache_put(self, request, key, data):
+        with self.cache_lock:
+            if len(data) > self.cache_size:
+                return
+            self.keys[request] = key
+            if key in self.cache:
+                return
+            self.cache[key] = (request, data)
+            self.cache_bytes += len(data)
+            while self.cache_bytes > self.cache_size:
+                old_key, (old_request, old_data) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(old_data)
+                if self.keys.get(old_request) == old_key:
+                    del self.keys[old_request]
+
+    def _cache_fresh(self, request):
+        # The key of the last picture holds until the next check of the tankopedia or of the player
+        server, language, player, _, _ = request
+        now = monotonic()
+        if (now - self.checks.get((server, language), -SERVE_TANKOPEDIA_CHECK) >= SERVE_TANKOPEDIA_CHECK) or \
+           (now - self.player_checks.get((server, player), -SERVE_PLAYER_CHECK) >= SERVE_PLAYER_CHECK):
+            return None
+        with self.cache_lock:
+            key = self.keys.get(request)
+        return None if key is None else self._cache_get(key)
+
+    def get(self, server, language, player, ext, options):
+        # A fresh picture is returned without waiting for the fetches of the other players
+        request = (server, language, player.lower(), ext, options)
+        data = self._cache_fresh(request)
+        if data is not None:
+            STATS.count('render_cache_hits')
+            return data
+
+        # Concurrent requests for the same picture wait for the first one
+        with self.cache_lock:
+            leader = request not in self.pending
+            if leader:
+                self.pending[request] = {'event': threading.Event(), 'data': None}
+            job = self.pending[request]
+        if not leader:
+            job['event'].wait()
+            return job['data']
+        try:
+            job['data'] = self._produce(server, language, player, ext, options)
+        finally:
+            with self.cache_lock:
+                del self.pending[request]
+            job['event'].set()
+        return job['data']
+
+    def _produce(self, server, language, player, ext, options):
+        request = (server, language, player.lower(), ext, options)
+        min_played, special, mastery, tier_helper = options
+        with self.lock:
+            wot = self.wot
+            wot.tld = server
+            wot.language = language
+            wot.player = player
+
+            # Fetch the missing data, each realm and language having its own tankopedia
+            if monotonic() - self.checks.get((server, language), -SERVE_TANKOPEDIA_CHECK) >= SERVE_TANKOPEDIA_CHECK:
+                if not wot.cache_tanks():
+                    return None
+                self.checks[(server, language)] = monotonic()
+            # The known players are refreshed from time to time, which only costs a call of account/info when they did not play
+            checked = monotonic()
+            refresh = checked - self.player_checks.get((server, player.lower()), -SERVE_PLAYER_CHECK) >= SERVE_PLAYER_CHECK
+            if not wot.search_player() or not wot.cache_player(refresh=refresh):
+                return None
+            if refresh:
+                self.player_checks[(server, player.lower())] = checked
+
+            # The rendered picture is reused as long as the data of the player did not change
+            row = wot.sql.execute(''' SELECT last_battle_time, updated_at
+                                      FROM players
+                                      WHERE server     = ?
+                                        AND account_id = ? ''',
+                                  (server, wot.account_id)).fetchone()
+            key = (server, language, wot.account_id, player, tuple(row) if row is not None else None,
+                   wot.get_version(), wot.get_version(language), ext, options)
+            data = self._cache_get(key)
+            if data is not None:
+                STATS.count('render_cache_hits')
+                self._cache_put(request, key, data)
+                return data
+            STATS.count('render_cache_misses')
+            buffer = wot.build_svg(min_played=min_played, special=special, mastery=mastery, tier_helper=tier_helper)
+        if buffer is None:
+            return None
+
+        # Final format
+        if ext == 'png':
+            if cairosvg is None:
+                return None
+            data = cairosvg.svg2png(bytestring=buffer.encode('utf-8'))
+        else:
+            data = buffer.encode('utf-8')
+        self._cache_put(request, key, data)
+        return data
+
+
+class _WotRequestHandler(BaseHTTPRequestHandler):
+    # URL: /tree/<server>/<player>.<svg|png>?min_played=0&special=1&mastery=1&tier=1&language=en, or /metrics
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            data = STATS.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        match = re.fullmatch(r'/tree/([a-z]+)/([^/]+)\.(svg|png)', url.path)
+        if match is None or match.group(1) not in SERVERS:
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+
+        def _param(name, default):
+            return _int(query.get(name, [default])[0])
+
+        options = (_param('min_played', 0), _param('special', 1) != 0, _param('mastery', 1) != 0, _param('tier', 1) != 0)
+        language = query.get('language', [self.server.service.language])[0]
+        if language not in LANGUAGES:
+            self.send_error(404)
+            return
+        try:
+            data = self.server.service.get(match.group(1), language, unquote(match.group(2)), match.group(3), options)
+        except Exception:
+            self.send_error(500)
+            return
+        if data is None:
+            self.send_error(404, 'Player not found')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/svg+xml' if match.group(3) == 'svg' else 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'max-age=300')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(address, language, transport=None):
+    # Long-running mode keeping the tankopedia, the database and the pictures warm
+    host, _, port = address.rpartition(':')
+    wot = WotTree(transport)
+    wot.language = language
+    server = ThreadingHTTPServer((host or '127.0.0.1', _int(port)), _WotRequestHandler)
+    server.service = WotService(wot)
+    print('Serving on http://%s:%d/tree/<server>/<player>.svg' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return True
+
+
+class _ApiRequestHandler(BaseHTTPRequestHandler):
+    # Stand-in of the API answering from the recorded responses: /<server>/<method>/?<parameters>
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [e for e in url.path.split('/') if e != '']
+        data = None
+        if len(parts) >= 2:
+            params = {}
+            for k, v in parse_qs(url.query, keep_blank_values=True).items():
+                params[k] = v[0]
+            data = self.server.transport.fetch(parts[0], '/'.join(parts[1:]), params)
+        if data is None:
+            data = json.dumps({'status': 'error', 'error': {'code': 404, 'message': 'RECORD_NOT_FOUND'}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_api(address, transport):
+    # Local replacement of the API for the offline runs and the benchmarks
+    host, _, port = address.rpartition(':')
+    server = ThreadingHTTPServer((host or '127.0.0.1', _int(port)), _ApiRequestHandler)
+    server.transport = transport
+    print('Serving the API on http://%s:%d/%%s/' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return True
+
+
+def main_batch(wot, argv, refresh_tankopedia, refresh_player):
+    # Only "." refreshes the cache without drawing
+    refresh_only = argv.filename == '.'
+    if not refresh_only and ('{player}' not in argv.filename):
+        print('Error: the filename must contain {player}, or be "." to only refresh the cache')
+        return False
+
+    # Read the list of players
+    try:
+        with open(argv.players_file, 'r', encoding='utf-8') as f:
+            names = [line.strip() for line in f if line.strip() != '']
+    except OSError:
+        print('Error: the list of players cannot be read')
         return False
 
+    # Fetch all the players at once
+    accounts = wot.search_players(names, refresh=refresh_player)
+    if accounts is None:
+        print('Error: the players cannot be searched, run again to resume')
+        return False
+    for name in names:
+        if name not in accounts:
+            print('Warning: player "%s" not found' % name)
+    if len(accounts) == 0:
+        print('Error: player not found')
+        return False
+    if not wot.cache_tanks(refresh=refresh_tankopedia):
+        print('Error: tanks not found')
+        return False
+    if not wot.cache_players(list(accounts.values()), refresh=refresh_player):
+        print("Error: player's tanks not found for some players, run again to resume")
+        return False
+
+    # Build the pictures
+    if refresh_only:
+        return True
+    result = wot.render_players(accounts,
+                                argv.filename,
+                                renderer=argv.renderer,
+                                workers=argv.jobs,
+                                min_played=argv.min_played,
+                                special=not argv.no_special,
+                                mastery=not argv.no_mastery,
+                                tier_helper=not argv.no_tier,
+                                as_of=argv.as_of,
+                                since=argv.since,
+                                remaining=argv.remaining)
+    print('Pictures: %d generated, %d unchanged, %d failed' % (result['generated'], result['unchanged'], result['failed']))
+    return True
+
+
+def main_analytics(wot, argv):
+    header, rows = wot.analytics(argv.analytics, min_played=argv.min_played)
+    if argv.filename in ['', '.', '..']:
+        sys.stdout.reconfigure(encoding='utf-8')
+        f = sys.stdout
+    else:
+        try:
+            f = open(argv.filename, 'w', encoding='utf-8', newline='')
+        except OSError:
+            print('Error: the report cannot be written')
+            return False
+    writer = csv.writer(f)
+    writer.writerow(header)
+    writer.writerows(rows)
+    if f is not sys.stdout:
+        f.close()
+    return True
+
+
+def main():
     # Read the command line
     parser = argparse.ArgumentParser(description='World of Tanks - Explore a player\'s tech tree')
     parser.add_argument('--server', default='', help='Realm (ex: eu)')
     parser.add_argument('--player', default='', help='Name of the player (ex: Pamboum)')
+    parser.add_argument('--players-file', default='', help='File listing one player per line, for the batch mode')
     parser.add_argument('--language', default='', help='Language (ex: en)')
     parser.add_argument('--update-tankopedia', action='store_true', help='Force the update of the tankopedia')
     parser.add_argument('--no-cache', action='store_true', help='Refresh the data of the player')
@@ -483,16 +2092,76 @@ def main():
     parser.add_argument('--no-special', action='store_true', help='Hide the special tanks out of the tech tree')
     parser.add_argument('--no-mastery', action='store_true', help='Hide the colors of mastery')
     parser.add_argument('--no-tier', action='store_true', help='Hide the left indicator showing the tiers')
-    parser.add_argument('filename', default='.', help='Final filename. Use "." for stdout')
+    parser.add_argument('--as-of', type=_timestamp, default=None, help='Draw the tree at a past date (ex: 2021-06-30 or 2021-06-30T18:00)')
+    parser.add_argument('--since', type=_timestamp, default=None, help='Highlight in blue the tanks unlocked since a date')
+    parser.add_argument('--remaining', action='store_true', help='Show the XP and credits still needed for the tanks not researched yet')
+    parser.add_argument('--analytics', default='', choices=['', 'lines', 'tiers', 'tanks'], help='Write a CSV report over all the players of the realm kept in the database')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of parallel processes to render the pictures in batch mode')
+    parser.add_argument('--renderer', default='dot', choices=['dot', 'native'], help='Use GraphViz or the built-in renderer (SVG, or PNG with cairosvg)')
+    parser.add_argument('--serve', default='', help='Run a local HTTP server on [host:]port instead of generating a picture')
+    parser.add_argument('--api-url', default='', help='Base URL of the API, where %%s is the realm (default: %s)' % API_URL.replace('%', '%%'))
+    parser.add_argument('--api-cache', default='', help='Folder caching the responses of the API')
+    parser.add_argument('--api-cache-ttl', type=int, default=3600, help='Lifetime of the cached responses in seconds')
+    parser.add_argument('--api-record', default='', help='Folder where all the responses of the API are recorded')
+    parser.add_argument('--api-replay', default='', help='Folder of the recorded responses to use instead of the API')
+    parser.add_argument('--serve-api', default='', help='Run a stand-in of the API on [host:]port answering from --api-replay')
+    parser.add_argument('--stats', default='', choices=['', 'json', 'prometheus'], help='Print the timings and counters of the run')
+    parser.add_argument('--stats-file', default='', help='File receiving the statistics instead of the standard error')
+    parser.add_argument('--profile', default='', help='File receiving the cProfile statistics of the measured phases')
+    parser.add_argument('filename', nargs='?', default='.', help='Final filename. Use "." for stdout. In batch mode, "{player}" is replaced by each name and "." only refreshes the cache')
     argv = parser.parse_args()
     refresh_tankopedia = argv.update_tankopedia
     refresh_player = argv.no_cache or refresh_tankopedia
 
+    # Check the registration
+    if len(APP_ID) != 32 and argv.api_url == '' and argv.api_replay == '':
+        print('Error: your must register the application first')
+        return False
+
+    # Access to the API
+    transport = HttpTransport(argv.api_url or API_URL)
+    if argv.api_replay != '':
+        transport = DiskTransport(argv.api_replay)
+    elif argv.api_record != '':
+        transport = DiskTransport(argv.api_record, inner=transport, ttl=0)
+    elif argv.api_cache != '':
+        transport = DiskTransport(argv.api_cache, inner=transport, ttl=argv.api_cache_ttl)
+    if argv.serve_api != '':
+        return serve_api(argv.serve_api, transport)
+    if argv.serve != '':
+        return serve(argv.serve, argv.language or 'en', transport)
+
     # Build the picture
+    if argv.profile != '':
+        STATS.profiler = cProfile.Profile()
+    try:
+        return _main_run(argv, transport, refresh_tankopedia, refresh_player)
+    finally:
+        _report_stats(argv)
+
+
+def _report_stats(argv):
+    if argv.profile != '':
+        STATS.profiler.dump_stats(argv.profile)
+    if argv.stats == '':
+        return
+    data = STATS.to_json() + '\n' if argv.stats == 'json' else STATS.to_prometheus()
+    if argv.stats_file == '':
+        sys.stderr.write(data)
+    else:
+        with open(argv.stats_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+
+def _main_run(argv, transport, refresh_tankopedia, refresh_player):
     result = False
-    wot = WotTree()
-    if not wot.set_parameters(server=argv.server, player=argv.player, language=argv.language):
+    wot = WotTree(transport)
+    if not wot.set_parameters(server=argv.server, player=argv.player, language=argv.language, batch=argv.players_file != '' or argv.analytics != ''):
         print('Error: invalid parameters')
+    elif argv.analytics != '':
+        result = main_analytics(wot, argv)
+    elif argv.players_file != '':
+        result = main_batch(wot, argv, refresh_tankopedia, refresh_player)
     else:
         if not wot.search_player(refresh=refresh_player):
             print('Error: player not found')
@@ -502,12 +2171,28 @@ def main():
             else:
                 if not wot.cache_player(refresh=refresh_player):
                     print("Error: player's tanks not found")
+                elif argv.renderer == 'native':
+                    if wot.generate_svg(argv.filename,
+                                        min_played=argv.min_played,
+                                        special=not argv.no_special,
+                                        mastery=not argv.no_mastery,
+                                        tier_helper=not argv.no_tier,
+                                        as_of=argv.as_of,
+                                        since=argv.since,
+                                        remaining=argv.remaining):
+                        result = True
+                        print('The picture is generated!')
+                    else:
+                        print('A problem occurred during the local generation of the picture')
                 else:
                     if wot.generate_graphviz(argv.filename,
                                              min_played=argv.min_played,
                                              special=not argv.no_special,
                                              mastery=not argv.no_mastery,
-                                             tier_helper=not argv.no_tier):
+                                             tier_helper=not argv.no_tier,
+                                             as_of=argv.as_of,
+                                             since=argv.since,
+                                             remaining=argv.remaining):
                         result = True
                         if wot.generate_picture(argv.filename):
                             print('The picture is generated!')
@@ -516,4 +2201,5 @@ def main():
     return result
 
 
-main()
+if __name__ == '__main__':
+    main()